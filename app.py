@@ -10,13 +10,17 @@ import pytesseract
 from PIL import Image
 import io
 import zipfile
+import tempfile
 import subprocess
 import base64
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 from flask import Response, session, stream_with_context, jsonify
 
 # Async + progress
 from threading import Thread, Lock
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 
 # --- Smartsheet + dotenv ---
@@ -24,8 +28,12 @@ from dotenv import load_dotenv
 import smartsheet
 # ---------------------------
 
+from storage import StorageManager
+
 # --- Gmail API imports ---
 from googleapiclient.discovery import build
+import google_auth_httplib2
+import httplib2
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
@@ -58,6 +66,39 @@ OUTPUT_FOLDER = '/tmp/outputs'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# Per-batch upload/output directories, output dedup and background eviction (see storage.py)
+def _make_storage(output_root: str) -> StorageManager:
+    return StorageManager(
+        UPLOAD_FOLDER, output_root,
+        quota_bytes=int(os.getenv("STORAGE_QUOTA_MB", "1024")) * 1024 * 1024,
+        max_age_seconds=int(float(os.getenv("STORAGE_MAX_AGE_HOURS", "24")) * 3600),
+        cleanup_interval=int(os.getenv("STORAGE_CLEANUP_INTERVAL", "600")),
+        min_free_bytes=int(os.getenv("STORAGE_MIN_FREE_MB", "256")) * 1024 * 1024,
+    )
+
+storage = _make_storage(OUTPUT_FOLDER)
+
+def use_output_folder(path: str):
+    """Point split-page output (and its storage manager) at another root; used by the CLIs' --output-dir."""
+    global OUTPUT_FOLDER, storage
+    path = os.path.abspath(path)
+    if path != os.path.abspath(OUTPUT_FOLDER):
+        OUTPUT_FOLDER = path
+        storage = _make_storage(path)
+
+@app.before_request
+def _start_storage_cleanup():
+    # Eviction runs only in web server processes, not in the CLIs that import this module
+    storage.start()
+
+# Largest file a chunked upload may declare, and the largest single request body (form posts, chunks)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+# Split/OCR runs on this pool so each uploaded file starts processing as soon as it is on disk
+PROCESSING_WORKERS = int(os.getenv("PROCESSING_WORKERS", "4"))
+processing_pool = ThreadPoolExecutor(max_workers=PROCESSING_WORKERS, thread_name_prefix="pod-process")
+
 # --- Secrets from .env ---
 UPLOAD_PASSWORD = os.getenv('UPLOAD_PASSWORD')  # set in .env
 SMARTSHEET_TOKEN = os.getenv("SMARTSHEET_API")  # set in .env
@@ -65,12 +106,29 @@ SMARTSHEET_TOKEN = os.getenv("SMARTSHEET_API")  # set in .env
 # Gmail config
 INBOUND_ATTACH_DIR = os.getenv("INBOUND_ATTACH_DIR", "/tmp/email_attachments")
 os.makedirs(INBOUND_ATTACH_DIR, exist_ok=True)
+# The Gmail job attaches what it downloads itself, so it saves into a subfolder that
+# watch_inbound.py (which does not recurse) never picks up a second time.
+GMAIL_ATTACH_DIR = os.getenv("GMAIL_ATTACH_DIR", os.path.join(INBOUND_ATTACH_DIR, "gmail"))
+os.makedirs(GMAIL_ATTACH_DIR, exist_ok=True)
 # Process all emails with attachments from the last 7 days (configurable via env)
 GMAIL_QUERY = os.getenv("GMAIL_QUERY", "has:attachment newer_than:7d")
 GMAIL_CREDENTIALS_FILE = os.getenv("GMAIL_CREDENTIALS_FILE", "credentials.json")
 GMAIL_TOKEN_FILE = os.getenv("GMAIL_TOKEN_FILE", "token.json")
 # Use readonly scope since we're not marking messages as read anymore
 GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+# Refresh the access token this many seconds before it expires
+GMAIL_REFRESH_MARGIN_SECONDS = int(os.getenv("GMAIL_REFRESH_MARGIN_SECONDS", "300"))
+GMAIL_HTTP_TIMEOUT = int(os.getenv("GMAIL_HTTP_TIMEOUT", "60"))
+# Idle Gmail services (each with its own kept-alive connection) kept for reuse by later jobs
+GMAIL_POOL_SIZE = int(os.getenv("GMAIL_POOL_SIZE", "4"))
+# Size of the Smartsheet HTTP connection pool shared by all threads in a process
+SMARTSHEET_MAX_CONNECTIONS = int(os.getenv("SMARTSHEET_MAX_CONNECTIONS", "16"))
+
+# Row write-back after a POD is attached (columns missing from a sheet are skipped)
+POD_RECEIVED_COLUMN = os.getenv("POD_RECEIVED_COLUMN", "POD Received")        # checkbox
+POD_RECEIVED_AT_COLUMN = os.getenv("POD_RECEIVED_AT_COLUMN", "POD Received At")  # date/time or text
+POD_SOURCE_COLUMN = os.getenv("POD_SOURCE_COLUMN", "POD Source File")         # text
+ROW_UPDATE_CHUNK_SIZE = int(os.getenv("ROW_UPDATE_CHUNK_SIZE", "200"))
 
 # ======== Customer mapping / PDF processing ========
 
@@ -134,11 +192,21 @@ def detect_customer(text):
             return customer
     return None
 
-def save_page_as_pdf(input_pdf_path, page_number, output_filename):
+def save_page_as_pdf(input_pdf_path, page_number, output_filename, batch_id=None):
+    """
+    Save one page as its own PDF. With a batch_id the page goes through the storage manager
+    (per-batch directory, deduplicated by content) and "<batch_id>/<name>.pdf" is returned.
+    """
     try:
         doc = fitz.open(input_pdf_path)
         new_doc = fitz.open()
         new_doc.insert_pdf(doc, from_page=page_number, to_page=page_number)
+        if batch_id:
+            # no_new_id keeps identical pages byte-identical so they hash the same
+            saved = storage.store_output(batch_id, output_filename + ".pdf", new_doc.tobytes(no_new_id=True))
+            new_doc.close()
+            logging.info(f"Saved page {page_number + 1} as {saved}")
+            return saved
         output_path = os.path.join(OUTPUT_FOLDER, output_filename + ".pdf")
         new_doc.save(output_path)
         new_doc.close()
@@ -158,7 +226,7 @@ def perform_ocr(page):
         logging.error(f"Error during OCR: {e}")
         return ""
 
-def process_pdf(pdf_path):
+def process_pdf(pdf_path, batch_id=None):
     saved_files = []
     try:
         doc = fitz.open(pdf_path)
@@ -193,7 +261,7 @@ def process_pdf(pdf_path):
                     else:
                         fallback_name = customer_mapping[customer]("", "").strip()
                         output_filename = f"{fallback_name}_{page_number + 1}"
-                saved = save_page_as_pdf(pdf_path, page_number, output_filename)
+                saved = save_page_as_pdf(pdf_path, page_number, output_filename, batch_id)
                 if saved:
                     saved_files.append(saved)
         doc.close()
@@ -224,6 +292,29 @@ def is_session_valid():
         return False
     return True
 
+def _process_upload(batch_id, file_path):
+    """Split/OCR one uploaded file and record its result in the batch. Returns the saved page paths."""
+    name = os.path.basename(file_path)
+    storage.record_result(batch_id, name, status="processing")
+    try:
+        saved_files = process_pdf(file_path, batch_id)
+        storage.record_result(batch_id, name, status="done", saved_files=saved_files)
+    except Exception as e:
+        logging.exception(f"Processing failed for {name}")
+        storage.record_result(batch_id, name, status="failed", error=str(e))
+        saved_files = []
+    storage.request_cleanup()
+    return saved_files
+
+def _current_saved_files():
+    """Saved pages for the session's batch (all files in it), falling back to the session list."""
+    batch_id = session.get('batch_id')
+    if batch_id:
+        results = storage.batch_results(batch_id)
+        if results:
+            return list(dict.fromkeys(f for r in results for f in r.get('saved_files', [])))
+    return session.get('saved_files', [])
+
 @app.route('/', methods=['GET', 'POST'])
 def upload_file():
     if not is_session_valid():
@@ -234,46 +325,158 @@ def upload_file():
         if 'pdf_file' not in request.files:
             flash('No file part')
             return redirect(request.url)
-        file = request.files['pdf_file']
-        if file.filename == '':
+        files = [f for f in request.files.getlist('pdf_file') if f and f.filename]
+        if not files:
             flash('No selected file')
             return redirect(request.url)
-        if file:
-            file_path = os.path.join(UPLOAD_FOLDER, file.filename)
+
+        batch_id = storage.new_batch_id()
+        futures = []
+        for file in files:
+            file_path = storage.upload_path(batch_id, file.filename)
             file.save(file_path)
-            saved_files = process_pdf(file_path)
-            session['saved_files'] = saved_files
-            session['login_time'] = datetime.utcnow().isoformat()
-            return render_template('download.html', saved_files=saved_files) if saved_files else redirect(url_for('upload_file'))
+            futures.append(processing_pool.submit(_process_upload, batch_id, file_path))
+        saved_files = [name for future in futures for name in future.result()]
+
+        session['batch_id'] = batch_id
+        session['saved_files'] = saved_files
+        session['login_time'] = datetime.utcnow().isoformat()
+        return render_template('download.html', saved_files=saved_files) if saved_files else redirect(url_for('upload_file'))
     return render_template('upload.html')
 
+# ------------------ Resumable chunked uploads ------------------
+# POST /uploads {filename, size[, batch_id]} -> upload_id; PUT chunks with Content-Range;
+# GET the upload to learn the offset to resume from. Each file is queued for splitting/OCR the
+# moment its last byte arrives, while the client keeps uploading the rest of the batch.
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    if not is_session_valid():
+        session.clear()
+        return {"error": "unauthorized"}, 401
+
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get('filename') or '')
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        size = 0
+    if not filename.lower().endswith('.pdf') or size <= 0:
+        return {"error": "filename must be a .pdf and size a positive byte count"}, 400
+    if size > MAX_UPLOAD_BYTES:
+        return {"error": f"file is larger than the {MAX_UPLOAD_BYTES // 1_048_576} MB upload limit"}, 413
+    if not storage.has_room(size):
+        storage.request_cleanup()
+        return {"error": "not enough free space for this upload; try again later"}, 507
+
+    batch_id = secure_filename(str(data.get('batch_id') or '')) or storage.new_batch_id()
+    state = storage.create_upload(batch_id, filename, size)
+    session['batch_id'] = batch_id
+    session['login_time'] = datetime.utcnow().isoformat()
+    return _upload_response(state), 201
+
+def _upload_response(state):
+    return {k: state[k] for k in ("batch_id", "upload_id", "filename", "size", "offset", "complete")}
+
+@app.route('/uploads/<batch_id>/<upload_id>', methods=['GET', 'PUT'])
+def resumable_upload(batch_id, upload_id):
+    if not is_session_valid():
+        session.clear()
+        return {"error": "unauthorized"}, 401
+
+    if request.method == 'GET':
+        state = storage.upload_state(batch_id, upload_id)
+        return (_upload_response(state), 200) if state else ({"error": "unknown upload"}, 404)
+
+    # Content-Range: bytes <start>-<end>/<total>
+    offset = 0
+    m = re.match(r'bytes (\d+)-\d+/\d+', request.headers.get('Content-Range', ''))
+    if m:
+        offset = int(m.group(1))
+    try:
+        state = storage.append_chunk(batch_id, upload_id, offset, request.stream)
+    except KeyError:
+        return {"error": "unknown upload"}, 404
+    except ValueError as e:
+        return {"error": "offset mismatch", "offset": e.args[0]}, 409
+    except BlockingIOError:
+        return {"error": "another chunk for this upload is still being written"}, 409
+
+    if state["just_completed"]:
+        processing_pool.submit(_process_upload, batch_id, state["path"])
+    return _upload_response(state), 200
+
+@app.route('/batch/<batch_id>')
+def batch_status(batch_id):
+    if not is_session_valid():
+        session.clear()
+        return {"error": "unauthorized"}, 401
+    files = storage.batch_results(batch_id)
+    if not files:
+        return {"error": "unknown batch"}, 404
+    pending = sum(1 for f in files if f["status"] not in ("done", "failed"))
+    return {
+        "batch_id": batch_id,
+        "files": files,
+        "pending": pending,
+        "done": pending == 0,
+        "saved_files": list(dict.fromkeys(name for f in files for name in f.get("saved_files", []))),
+    }, 200
+
+@app.route('/batch/<batch_id>/view')
+def batch_view(batch_id):
+    """Make a (chunk-uploaded) batch the session's current results and show the download/match page."""
+    if not is_session_valid():
+        session.clear()
+        return redirect(url_for('login'))
+    session['batch_id'] = secure_filename(batch_id)
+    session.pop('saved_files', None)
+    saved_files = _current_saved_files()
+    if not saved_files:
+        flash("No customer pages were found in this batch yet.")
+        return redirect(url_for('upload_file'))
+    storage.touch_batch(batch_id)
+    return render_template('download.html', saved_files=saved_files)
+
 @app.route('/download/<path:filename>')
 def download_file(filename):
+    if '/' in filename:
+        storage.touch_batch(filename.split('/', 1)[0])
     return send_from_directory(OUTPUT_FOLDER, filename, as_attachment=True)
 
 @app.route('/download_all')
 def download_all():
-    saved_files = session.get('saved_files', [])
+    saved_files = _current_saved_files()
     if not saved_files:
         flash("No recent files available for download.")
         return redirect(url_for('upload_file'))
 
     zip_filename = "processed_files.zip"
-    zip_path = os.path.join(OUTPUT_FOLDER, zip_filename)
+    batch_id = session.get('batch_id')
+    if batch_id:
+        storage.touch_batch(batch_id)
+        zip_dir = storage.output_dir(batch_id)
+    else:
+        zip_dir = OUTPUT_FOLDER
 
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
+    # An unnamed temp file per download, so concurrent downloads of one batch don't write the same
+    # zip; it disappears once the response closes it.
+    zip_file = tempfile.TemporaryFile(dir=zip_dir)
+    with zipfile.ZipFile(zip_file, 'w') as zipf:
         for file_name in saved_files:
             file_path = os.path.join(OUTPUT_FOLDER, file_name)
             if os.path.exists(file_path):
-                zipf.write(file_path, file_name)
+                zipf.write(file_path, os.path.basename(file_name))
+    zip_file.seek(0)
 
-    return send_file(zip_path, as_attachment=True)
+    return send_file(zip_file, as_attachment=True, download_name=zip_filename)
 
 # ===================== Smartsheet Integration: Test PODS =====================
 
 if not SMARTSHEET_TOKEN:
     logging.error("SMARTSHEET_API env var is missing. Add it to your .env")
-ss_client = smartsheet.Smartsheet(SMARTSHEET_TOKEN) if SMARTSHEET_TOKEN else None
+# One client per process: its requests session pools keep-alive connections across requests and threads.
+ss_client = smartsheet.Smartsheet(SMARTSHEET_TOKEN, max_connections=SMARTSHEET_MAX_CONNECTIONS) if SMARTSHEET_TOKEN else None
 
 WORKSPACE_NAME = "Test PODS"  # Target workspace name
 _RESOLVED_WORKSPACE_ID = None  # cache once resolved
@@ -328,6 +531,340 @@ def find_row_by_delivery_number(sheet_id: int, delivery_number: str):
                     return row.id
     return None
 
+def build_delivery_index(sheet_id: int) -> tuple[dict[str, int], set[int] | None]:
+    """
+    Fetch a sheet once and map each delivery number to the first row holding it.
+    Mirrors find_row_by_delivery_number, for callers matching many files against one sheet.
+    Also returns the ids of rows whose POD_RECEIVED_COLUMN is checked (None if the sheet has no such column).
+    """
+    index = {}
+    if not ss_client:
+        return index, None
+    sheet = ss_client.Sheets.get_sheet(sheet_id)
+    delivery_col_id = None
+    received_col_id = None
+    for col in sheet.columns:
+        title = col.title.strip().lower()
+        if title == "delivery #" and delivery_col_id is None:
+            delivery_col_id = col.id
+        elif POD_RECEIVED_COLUMN and title == POD_RECEIVED_COLUMN.strip().lower():
+            received_col_id = col.id
+
+    received = set() if received_col_id else None
+    for row in sheet.rows:
+        for cell in row.cells:
+            if received_col_id and cell.column_id == received_col_id:
+                if getattr(cell, "value", None) is True:
+                    received.add(row.id)
+                continue
+            if delivery_col_id and cell.column_id != delivery_col_id:
+                continue
+            value = str(cell.display_value or "").strip()
+            if value:
+                index.setdefault(value, row.id)
+    return index, received
+
+def resolve_workspace_id():
+    """Return the cached Test PODS workspace ID, resolving it on first use (None if not found)."""
+    global _RESOLVED_WORKSPACE_ID
+    if _RESOLVED_WORKSPACE_ID is None and ss_client:
+        _RESOLVED_WORKSPACE_ID = get_workspace_id_by_name(WORKSPACE_NAME)
+        logging.info(f"Resolved workspace '{WORKSPACE_NAME}' to ID: {_RESOLVED_WORKSPACE_ID}")
+    return _RESOLVED_WORKSPACE_ID
+
+def current_month_candidates() -> list[str]:
+    """Current and previous month sheet names, long and short forms (e.g. 'August 2025', 'Aug 2025')."""
+    now = datetime.now()
+    prev = now.replace(day=1) - timedelta(days=1)
+    return [
+        now.strftime('%B %Y'), now.strftime('%b %Y'),
+        prev.strftime('%B %Y'), prev.strftime('%b %Y'),
+    ]
+
+def find_delivery_match(filename: str, month_candidates: list[str], lookup_cache: dict | None = None):
+    """
+    Find the Smartsheet row for a saved POD file by its delivery number.
+    Returns a match dict (delivery_number, file, sheet_name, sheet_id, row_id) or None.
+    Pass a dict as lookup_cache to reuse sheet IDs and row indexes across many files; matches then
+    also carry pod_received (whether the row is already marked, None if the sheet can't tell).
+    """
+    delivery_number = extract_delivery_from_filename(os.path.basename(filename))
+    if not delivery_number:
+        return None
+    workspace_id = resolve_workspace_id()
+    if workspace_id is None:
+        return None
+
+    # Try each month sheet until we find a row
+    seen_sheets = set()
+    for month_name in month_candidates:
+        if month_name in seen_sheets:
+            continue
+        seen_sheets.add(month_name)
+
+        received = None
+        if lookup_cache is None:
+            sheet_id = find_sheet_id_by_name_in_workspace(workspace_id, month_name)
+            row_id = find_row_by_delivery_number(sheet_id, delivery_number) if sheet_id else None
+        else:
+            if ("sheet", month_name) not in lookup_cache:
+                lookup_cache[("sheet", month_name)] = find_sheet_id_by_name_in_workspace(workspace_id, month_name)
+            sheet_id = lookup_cache[("sheet", month_name)]
+            if not sheet_id:
+                continue
+            if ("rows", sheet_id) not in lookup_cache:
+                lookup_cache[("rows", sheet_id)], lookup_cache[("received", sheet_id)] = build_delivery_index(sheet_id)
+            row_id = lookup_cache[("rows", sheet_id)].get(delivery_number)
+            received = lookup_cache[("received", sheet_id)]
+
+        if row_id:
+            return {
+                "delivery_number": delivery_number,
+                "file": filename,
+                "sheet_name": month_name,
+                "sheet_id": sheet_id,
+                "row_id": row_id,
+                "pod_received": None if received is None else row_id in received,
+            }
+    return None
+
+def file_size_in_kb(file_path: str) -> int:
+    """Local file size rounded up to whole KB, as Smartsheet reports sizeInKb."""
+    return -(-os.path.getsize(file_path) // 1024)
+
+def _same_attachment(attached_kb, size_in_kb) -> bool:
+    # Smartsheet rounds sizes to KB, so allow 1 KB either way; an unknown size matches on name alone.
+    if attached_kb is None or size_in_kb is None:
+        return True
+    return abs(int(attached_kb) - int(size_in_kb)) <= 1
+
+def row_has_attachment(sheet_id, row_id, filename: str, size_in_kb=None) -> bool:
+    """
+    Single-file check with one list_row_attachments call; use AttachmentIndex for batches.
+    True if the row already has an attachment with this name (and about this size, if given).
+    """
+    try:
+        atts = ss_client.Attachments.list_row_attachments(int(sheet_id), int(row_id), include_all=True)
+        return any(getattr(a, "name", "") == filename and _same_attachment(getattr(a, "size_in_kb", None), size_in_kb)
+                   for a in (atts.data or []))
+    except Exception as e:
+        # If listing fails, don't block the upload.
+        logging.warning(f"Could not list attachments for row {row_id}: {e}")
+        return False
+
+class AttachmentIndex:
+    """
+    Filenames (and sizes in KB) already attached to each row, built from a single sheet-level
+    attachment listing per sheet instead of one list_row_attachments call per file.
+    Create one per batch (Gmail job, bulk upload, CLI run); attach_pdf_to_row keeps it current.
+    A same-named file of a different size is treated as a new document, not a duplicate.
+    """
+
+    def __init__(self):
+        self._sheets = {}  # sheet_id -> {row_id: {filename: size_in_kb}}
+        self._lock = Lock()
+
+    def _rows(self, sheet_id) -> dict | None:
+        """The sheet's {row_id: {filename: size_in_kb}}, or None if it could not be listed (retried next call)."""
+        sheet_id = int(sheet_id)
+        with self._lock:
+            if sheet_id not in self._sheets:
+                rows = {}
+                try:
+                    resp = ss_client.Attachments.list_all_attachments(sheet_id, include_all=True)
+                    if getattr(resp, "data", None) is None:
+                        # Without errors_as_exceptions the SDK returns an Error object instead of raising
+                        raise RuntimeError(getattr(getattr(resp, "result", None), "message", resp))
+                    for att in resp.data:
+                        if "ROW" not in str(getattr(att, "parent_type", "")).upper():
+                            continue
+                        rows.setdefault(int(att.parent_id), {})[att.name] = getattr(att, "size_in_kb", None)
+                except Exception as e:
+                    logging.warning(f"Could not list attachments for sheet {sheet_id}: {e}")
+                    return None
+                self._sheets[sheet_id] = rows
+            return self._sheets[sheet_id]
+
+    def has(self, sheet_id, row_id, filename: str, size_in_kb=None) -> bool:
+        """True if a file with this name (and about this size, if given) is already attached to the row."""
+        rows = self._rows(sheet_id)
+        if rows is None:
+            # Sheet listing failed: check just this row rather than skipping the duplicate check.
+            return row_has_attachment(sheet_id, row_id, filename, size_in_kb)
+        attached = rows.get(int(row_id), {})
+        return filename in attached and _same_attachment(attached[filename], size_in_kb)
+
+    def add(self, sheet_id, row_id, filename: str, size_in_kb=None):
+        """Record an attach made in this batch so later duplicates are skipped without an API call."""
+        rows = self._rows(sheet_id)
+        if rows is None:
+            return  # the next successful listing includes this attach
+        with self._lock:
+            rows.setdefault(int(row_id), {})[filename] = size_in_kb
+
+class RowStatusWriter:
+    """
+    Collects "POD received" updates (checkbox, timestamp, source filename) for rows attached in a
+    batch and writes them with bulk update_rows calls of up to ROW_UPDATE_CHUNK_SIZE rows per sheet.
+    Chunks are sent with allowPartialSuccess, so one bad row doesn't sink the rest. Rows that fail
+    are resent once at the end of the flush; rows that fail again are kept in failed_rows.
+    """
+
+    def __init__(self, chunk_size: int = ROW_UPDATE_CHUNK_SIZE):
+        self.chunk_size = max(1, chunk_size)
+        self.updated = 0
+        self.failed = 0
+        self.calls = 0
+        self.failed_rows = {}  # (sheet_id, row_id) -> files, for updates that failed twice
+        self._pending = {}  # sheet_id -> {row_id: {"files": [...], "received_at": iso}}
+        self._columns = {}  # sheet_id -> {POD_*_COLUMN title: (column_id, column type)}
+        self._lock = Lock()
+
+    def add(self, sheet_id, row_id, filename: str):
+        """Queue a row update; flushes that sheet early once a full chunk is pending."""
+        sheet_id, row_id = int(sheet_id), int(row_id)
+        with self._lock:
+            rows = self._pending.setdefault(sheet_id, {})
+            entry = rows.setdefault(row_id, {"files": [], "received_at": None})
+            if filename not in entry["files"]:
+                entry["files"].append(filename)
+            entry["received_at"] = datetime.now().isoformat(timespec='seconds')
+            full = len(rows) >= self.chunk_size
+        if full:
+            self.flush(sheet_id)
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(rows) for rows in self._pending.values())
+
+    def unwritten(self, sheet_id, row_id) -> bool:
+        """True if the row's update is still queued or failed for good."""
+        sheet_id, row_id = int(sheet_id), int(row_id)
+        with self._lock:
+            return (sheet_id, row_id) in self.failed_rows or row_id in self._pending.get(sheet_id, {})
+
+    def _column_ids(self, sheet_id: int) -> dict | None:
+        """Ids and types of the POD status columns on a sheet, or None if they could not be read (not cached)."""
+        if sheet_id not in self._columns:
+            wanted = {t.strip().lower(): t for t in (POD_RECEIVED_COLUMN, POD_RECEIVED_AT_COLUMN, POD_SOURCE_COLUMN) if t}
+            found = {}
+            try:
+                resp = ss_client.Sheets.get_columns(sheet_id, include_all=True)
+                if getattr(resp, "data", None) is None:
+                    # Without errors_as_exceptions the SDK returns an Error object instead of raising
+                    raise RuntimeError(getattr(getattr(resp, "result", None), "message", resp))
+                for col in resp.data:
+                    title = wanted.get(col.title.strip().lower())
+                    if title:
+                        found[title] = (col.id, str(getattr(col, "type", "") or ""))
+            except Exception as e:
+                logging.warning(f"Could not read columns for sheet {sheet_id}: {e}")
+                return None
+            if not found:
+                logging.info(f"Sheet {sheet_id} has none of the POD status columns; skipping write-back")
+            self._columns[sheet_id] = found
+        return self._columns[sheet_id]
+
+    def _build_row(self, columns: dict, row_id: int, entry: dict):
+        row = smartsheet.models.Row()
+        row.id = row_id
+        values = {
+            POD_RECEIVED_COLUMN: True,
+            POD_RECEIVED_AT_COLUMN: entry["received_at"],
+            POD_SOURCE_COLUMN: ", ".join(entry["files"]),
+        }
+        for title, (column_id, column_type) in columns.items():
+            cell = smartsheet.models.Cell()
+            cell.column_id = column_id
+            cell.value = values[title]
+            if title == POD_RECEIVED_AT_COLUMN and column_type == "DATE":
+                # DATE columns only take YYYY-MM-DD; DATETIME and text columns get the full timestamp
+                cell.value = entry["received_at"][:10]
+            row.cells.append(cell)
+        return row
+
+    def _send(self, sheet_id: int, rows: list) -> list[int]:
+        """
+        One update_rows call for a chunk; returns the ids of the rows that were not updated.
+        Without errors_as_exceptions the SDK returns an Error object for request-level failures
+        (auth, rate limit after the SDK's own retries, 5xx); those fail the whole chunk, and retrying
+        it row by row would only repeat the same error.
+        """
+        self.calls += 1
+        try:
+            resp = ss_client.Sheets.update_rows_with_partial_success(sheet_id, rows)
+        except Exception as e:
+            resp, error = None, e
+        else:
+            error = None if getattr(resp, "message", None) in ("SUCCESS", "PARTIAL_SUCCESS") \
+                else getattr(getattr(resp, "result", None), "message", resp)
+        if error is not None:
+            logging.error(f"Row update of {len(rows)} row(s) failed for sheet {sheet_id}: {error}")
+            return [row.id for row in rows]
+        failed_ids = []
+        for item in getattr(resp, "failed_items", None) or []:
+            row_id = getattr(item, "row_id", None)
+            if row_id is None and getattr(item, "index", None) is not None:
+                row_id = rows[item.index].id
+            logging.error(f"Row update failed for sheet {sheet_id}, row {row_id}: "
+                          f"{getattr(getattr(item, 'error', None), 'message', item)}")
+            failed_ids.append(row_id)
+        self.updated += len(rows) - len(failed_ids)
+        return failed_ids
+
+    def _requeue(self, sheet_id: int, entries: dict):
+        """Put unsent updates back, merging with any queued for the same rows since the flush began."""
+        with self._lock:
+            rows = self._pending.setdefault(sheet_id, {})
+            for row_id, entry in entries.items():
+                newer = rows.get(row_id)
+                if newer:
+                    entry["files"] += [f for f in newer["files"] if f not in entry["files"]]
+                    entry["received_at"] = newer["received_at"]
+                rows[row_id] = entry
+
+    def flush(self, sheet_id=None):
+        """Write pending updates (for one sheet, or all). Safe to call when nothing is pending."""
+        with self._lock:
+            sheet_ids = [int(sheet_id)] if sheet_id is not None else list(self._pending)
+            batches = {sid: self._pending.pop(sid, {}) for sid in sheet_ids}
+        for sid, entries in batches.items():
+            if not entries or not ss_client:
+                continue
+            columns = self._column_ids(sid)
+            if columns is None:
+                self._requeue(sid, entries)
+                logging.warning(f"Kept {len(entries)} row update(s) for sheet {sid} pending; retrying on the next flush")
+                continue
+            if not columns:
+                continue
+            rows = [self._build_row(columns, row_id, entry) for row_id, entry in entries.items()]
+            failed_ids = []
+            for i in range(0, len(rows), self.chunk_size):
+                failed_ids += self._send(sid, rows[i:i + self.chunk_size])
+            if failed_ids:
+                # Resend the failed rows once, together, before giving up on them
+                retry = [row for row in rows if row.id in failed_ids]
+                still_failed = []
+                for i in range(0, len(retry), self.chunk_size):
+                    still_failed += self._send(sid, retry[i:i + self.chunk_size])
+                self.failed += len(still_failed)
+                for row_id in still_failed:
+                    self.failed_rows[(sid, row_id)] = entries.get(row_id, {}).get("files", [])
+        return self.updated, self.failed
+
+def attach_pdf_to_row(sheet_id, row_id, file_path: str, filename: str | None = None,
+                      attachment_index: AttachmentIndex | None = None):
+    """Attach a local PDF to a Smartsheet row. Raises on API errors."""
+    filename = filename or os.path.basename(file_path)
+    with open(file_path, 'rb') as fh:
+        ss_client.Attachments.attach_file_to_row(
+            int(sheet_id), int(row_id), (filename, fh, 'application/pdf')
+        )
+    if attachment_index is not None:
+        attachment_index.add(sheet_id, row_id, filename, file_size_in_kb(file_path))
+
 def extract_delivery_from_filename(filename: str):
     """
     Try to capture an 8-digit delivery number starting with 1 from the saved filename.
@@ -410,19 +947,21 @@ def pick_month_candidates_from_filename(filename: str) -> list[str]:
 
     return list(cands)
 
-def upload_file_by_delivery(file_path: str):
+def upload_file_by_delivery(file_path: str, attachment_index: AttachmentIndex | None = None,
+                            row_writer: RowStatusWriter | None = None):
     """
     Given a local PDF path, extract delivery # from filename, find matching row in Test PODS,
     and attach the file. Returns (success, message).
+    Pass a shared AttachmentIndex when uploading many files so each sheet is listed only once
+    (without one, only the target row's attachments are listed), and a shared RowStatusWriter
+    (flushed by the caller) to batch the row status updates.
     """
-    global _RESOLVED_WORKSPACE_ID
     if not ss_client:
         return (False, "Smartsheet not configured")
 
-    if _RESOLVED_WORKSPACE_ID is None:
-        _RESOLVED_WORKSPACE_ID = get_workspace_id_by_name(WORKSPACE_NAME)
-        if _RESOLVED_WORKSPACE_ID is None:
-            return (False, f"Workspace '{WORKSPACE_NAME}' not found")
+    workspace_id = resolve_workspace_id()
+    if workspace_id is None:
+        return (False, f"Workspace '{WORKSPACE_NAME}' not found")
 
     filename = os.path.basename(file_path)
     delivery = extract_delivery_from_filename_loose(filename)
@@ -430,23 +969,27 @@ def upload_file_by_delivery(file_path: str):
         return (False, f"No 8-digit delivery number found in '{filename}'")
 
     for month_name in pick_month_candidates_from_filename(filename):
-        sheet_id = find_sheet_id_by_name_in_workspace(_RESOLVED_WORKSPACE_ID, month_name)
+        sheet_id = find_sheet_id_by_name_in_workspace(workspace_id, month_name)
         if not sheet_id:
             continue
         row_id = find_row_by_delivery_number(sheet_id, delivery)
         if row_id:
-            # Optional idempotency: skip if same filename already attached
-            try:
-                atts = ss_client.Attachments.list_row_attachments(sheet_id, row_id)
-                if any(getattr(a, "name", "") == filename for a in (atts.data or [])):
-                    return (True, f"Already attached on row {row_id} in {month_name}")
-            except Exception:
-                pass
+            # Idempotency: skip if same filename already attached (single files check just their row)
+            size_in_kb = file_size_in_kb(file_path)
+            if attachment_index is not None:
+                already = attachment_index.has(sheet_id, row_id, filename, size_in_kb)
+            else:
+                already = row_has_attachment(sheet_id, row_id, filename, size_in_kb)
+            if already:
+                return (True, f"Already attached on row {row_id} in {month_name}")
             try:
-                with open(file_path, 'rb') as fh:
-                    ss_client.Attachments.attach_file_to_row(
-                        int(sheet_id), int(row_id), (filename, fh, 'application/pdf')
-                    )
+                attach_pdf_to_row(sheet_id, row_id, file_path, filename, attachment_index)
+                if row_writer is not None:
+                    row_writer.add(sheet_id, row_id, filename)
+                else:
+                    single = RowStatusWriter()
+                    single.add(sheet_id, row_id, filename)
+                    single.flush()
                 return (True, f"Uploaded to {month_name} (row {row_id}) for delivery {delivery}")
             except Exception as e:
                 logging.exception("Attach failed")
@@ -456,8 +999,18 @@ def upload_file_by_delivery(file_path: str):
 
 # ===================== Gmail: service, message processing, PROGRESS =====================
 
-def gmail_service():
-    """Get Gmail service using OAuth2."""
+def _save_refreshed_token(creds):
+    # For local development, save refreshed token back to file
+    if not os.getenv('GMAIL_TOKEN_JSON') and os.path.exists(os.path.dirname(GMAIL_TOKEN_FILE) if os.path.dirname(GMAIL_TOKEN_FILE) else '.'):
+        try:
+            with open(GMAIL_TOKEN_FILE, 'w') as token:
+                token.write(creds.to_json())
+            logging.info("Saved refreshed token to file")
+        except Exception as e:
+            logging.error(f"Could not save refreshed token: {e}")
+
+def _load_gmail_credentials():
+    """Load Gmail OAuth2 credentials from env/token file, refreshing or running the local flow if needed."""
     creds = None
     
     # First try to load from environment variables (for production)
@@ -481,16 +1034,7 @@ def gmail_service():
             try:
                 creds.refresh(Request())
                 logging.info("Refreshed Gmail credentials")
-                
-                # For local development, save refreshed token back to file
-                if not os.getenv('GMAIL_TOKEN_JSON') and os.path.exists(os.path.dirname(GMAIL_TOKEN_FILE) if os.path.dirname(GMAIL_TOKEN_FILE) else '.'):
-                    try:
-                        with open(GMAIL_TOKEN_FILE, 'w') as token:
-                            token.write(creds.to_json())
-                        logging.info("Saved refreshed token to file")
-                    except Exception as e:
-                        logging.error(f"Could not save refreshed token: {e}")
-                        
+                _save_refreshed_token(creds)
             except Exception as e:
                 logging.error(f"Error refreshing credentials: {e}")
                 creds = None
@@ -532,7 +1076,59 @@ def gmail_service():
             else:
                 raise RuntimeError("Gmail credentials not found. Set GMAIL_TOKEN_JSON and GMAIL_CREDENTIALS_JSON environment variables for production.")
 
-    return build('gmail', 'v1', credentials=creds)
+    return creds
+
+# Credentials are shared process-wide. httplib2 connections are not thread-safe, so each
+# service is used by one job at a time: jobs check one out of a process-wide pool and return it,
+# keeping its connection alive for the next job instead of opening a new one per thread.
+_gmail_creds = None
+_gmail_creds_lock = Lock()
+_gmail_pool = []  # idle (creds, service) pairs
+_gmail_pool_lock = Lock()
+
+def _fresh_gmail_credentials():
+    """Return cached credentials, refreshing them shortly before they expire rather than on a 401."""
+    global _gmail_creds
+    with _gmail_creds_lock:
+        if _gmail_creds is None:
+            _gmail_creds = _load_gmail_credentials()
+        creds = _gmail_creds
+        expiring = creds.expiry is not None and creds.expiry - datetime.utcnow() < timedelta(seconds=GMAIL_REFRESH_MARGIN_SECONDS)
+        if (expiring or not creds.valid) and creds.refresh_token:
+            try:
+                creds.refresh(Request())
+                logging.info("Proactively refreshed Gmail credentials")
+                _save_refreshed_token(creds)
+            except Exception as e:
+                logging.error(f"Error refreshing credentials: {e}")
+                if not creds.valid:
+                    _gmail_creds = None
+                    raise RuntimeError("Gmail token expired and could not be refreshed") from e
+        return creds
+
+@contextmanager
+def gmail_service():
+    """
+    Check out a Gmail service from the process-wide pool for the duration of a with-block.
+    New services are built from the bundled discovery document; ones built for replaced
+    credentials are dropped.
+    """
+    creds = _fresh_gmail_credentials()
+    svc = None
+    with _gmail_pool_lock:
+        while _gmail_pool and svc is None:
+            pooled_creds, pooled_svc = _gmail_pool.pop()
+            if pooled_creds is creds:
+                svc = pooled_svc
+    if svc is None:
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=GMAIL_HTTP_TIMEOUT))
+        svc = build('gmail', 'v1', http=http, static_discovery=True, cache_discovery=False)
+    try:
+        yield svc
+    finally:
+        with _gmail_pool_lock:
+            if len(_gmail_pool) < GMAIL_POOL_SIZE:
+                _gmail_pool.append((creds, svc))
 
 def _iter_parts(payload):
     """Yield all parts recursively."""
@@ -551,8 +1147,7 @@ def _set_progress(job_id, **kwargs):
         progress_store.setdefault(job_id, {"total": 0, "processed": 0, "skipped": 0, "done": False, "logs": []})
         progress_store[job_id].update(**kwargs)
 
-def count_pdf_attachments(query: str) -> int:
-    svc = gmail_service()
+def count_pdf_attachments(svc, query: str) -> int:
     total = 0
     next_page_token = None
     while True:
@@ -573,70 +1168,73 @@ def count_pdf_attachments(query: str) -> int:
     return total
 
 def _gmail_worker(job_id: str, query: str):
+    row_writer = RowStatusWriter()
     try:
-        total = count_pdf_attachments(query)
-        _set_progress(job_id, total=total)
-
-        svc = gmail_service()
-        processed = 0
-        skipped = 0
-        next_page_token = None
-
-        while True:
-            kwargs = {'userId': 'me', 'q': query}
-            if next_page_token:
-                kwargs['pageToken'] = next_page_token
-            resp = svc.users().messages().list(**kwargs).execute()
-            messages = resp.get('messages', [])
-
-            for msg in messages:
-                msg_data = svc.users().messages().get(userId='me', id=msg['id']).execute()
-                found_any = False
-
-                for part in _iter_parts(msg_data.get('payload', {})):
-                    filename = part.get('filename') or ''
-                    if not filename.lower().endswith('.pdf'):
-                        continue
-
-                    data = None
-                    body = part.get('body', {})
-                    if 'data' in body:
-                        data = body['data']
-                    elif 'attachmentId' in body:
-                        att = svc.users().messages().attachments().get(
-                            userId='me', messageId=msg['id'], id=body['attachmentId']
-                        ).execute()
-                        data = att.get('data')
-
-                    if not data:
-                        skipped += 1
-                        _set_progress(job_id, skipped=skipped)
-                        continue
-
-                    file_bytes = base64.urlsafe_b64decode(data)
-                    safe_name = secure_filename(filename)
-                    local_path = os.path.join(INBOUND_ATTACH_DIR, safe_name)
-                    with open(local_path, 'wb') as f:
-                        f.write(file_bytes)
-
-                    ok, _msg = upload_file_by_delivery(local_path)
-                    if ok:
-                        processed += 1
-                    else:
-                        skipped += 1
-                    found_any = True
-
-                    _set_progress(job_id, processed=processed, skipped=skipped)
-
-                # Note: We no longer mark messages as read since we're processing all emails with attachments
-
-            next_page_token = resp.get('nextPageToken')
-            if not next_page_token:
-                break
-
-        _set_progress(job_id, done=True)
+        with gmail_service() as svc:
+            total = count_pdf_attachments(svc, query)
+            _set_progress(job_id, total=total)
+
+            attachment_index = AttachmentIndex()
+            processed = 0
+            skipped = 0
+            next_page_token = None
+
+            while True:
+                kwargs = {'userId': 'me', 'q': query}
+                if next_page_token:
+                    kwargs['pageToken'] = next_page_token
+                resp = svc.users().messages().list(**kwargs).execute()
+                messages = resp.get('messages', [])
+
+                for msg in messages:
+                    msg_data = svc.users().messages().get(userId='me', id=msg['id']).execute()
+                    found_any = False
+
+                    for part in _iter_parts(msg_data.get('payload', {})):
+                        filename = part.get('filename') or ''
+                        if not filename.lower().endswith('.pdf'):
+                            continue
+
+                        data = None
+                        body = part.get('body', {})
+                        if 'data' in body:
+                            data = body['data']
+                        elif 'attachmentId' in body:
+                            att = svc.users().messages().attachments().get(
+                                userId='me', messageId=msg['id'], id=body['attachmentId']
+                            ).execute()
+                            data = att.get('data')
+
+                        if not data:
+                            skipped += 1
+                            _set_progress(job_id, skipped=skipped)
+                            continue
+
+                        file_bytes = base64.urlsafe_b64decode(data)
+                        safe_name = secure_filename(filename)
+                        local_path = os.path.join(GMAIL_ATTACH_DIR, safe_name)
+                        with open(local_path, 'wb') as f:
+                            f.write(file_bytes)
+
+                        ok, _msg = upload_file_by_delivery(local_path, attachment_index, row_writer)
+                        if ok:
+                            processed += 1
+                        else:
+                            skipped += 1
+                        found_any = True
+
+                        _set_progress(job_id, processed=processed, skipped=skipped)
+
+                    # Note: We no longer mark messages as read since we're processing all emails with attachments
+
+                next_page_token = resp.get('nextPageToken')
+                if not next_page_token:
+                    break
     except Exception as e:
         logging.exception("Gmail worker failed")
+    finally:
+        # Mark whatever was attached, even if the job stopped early
+        row_writer.flush()
         _set_progress(job_id, done=True)
 
 # ----- async start + poll routes -----
@@ -682,60 +1280,29 @@ def get_progress(job_id):
 @app.route('/smartsheet_match', methods=['GET', 'POST'])
 def smartsheet_match():
     """
-    POST: compute matches from session['saved_files'], store in session, then redirect (PRG) to GET.
+    POST: compute matches from the session's saved files, store in session, then redirect (PRG) to GET.
     GET: render the matches currently stored in session.
     """
-    global _RESOLVED_WORKSPACE_ID
-
     if request.method == 'POST':
         if not ss_client:
             flash("Smartsheet is not configured. Set SMARTSHEET_API in your .env.")
             return redirect(url_for('upload_file'))
 
-        saved_files = session.get('saved_files', [])
+        saved_files = _current_saved_files()
         delivery_matches = []
 
         # Resolve the workspace ID once
-        if _RESOLVED_WORKSPACE_ID is None:
-            _RESOLVED_WORKSPACE_ID = get_workspace_id_by_name(WORKSPACE_NAME)
-            logging.info(f"Resolved workspace '{WORKSPACE_NAME}' to ID: {_RESOLVED_WORKSPACE_ID}")
-            if _RESOLVED_WORKSPACE_ID is None:
-                flash(f"Workspace '{WORKSPACE_NAME}' not found or not shared with this API user.")
-                return redirect(url_for('upload_file'))
-
-        now = datetime.now()
+        if resolve_workspace_id() is None:
+            flash(f"Workspace '{WORKSPACE_NAME}' not found or not shared with this API user.")
+            return redirect(url_for('upload_file'))
+
         # Support both long and short month names
-        month_candidates = [
-            now.strftime('%B %Y'), now.strftime('%b %Y'),
-            (now.replace(day=1) - timedelta(days=1)).strftime('%B %Y'),
-            (now.replace(day=1) - timedelta(days=1)).strftime('%b %Y'),
-        ]
+        month_candidates = current_month_candidates()
 
         for filename in saved_files:
-            delivery_number = extract_delivery_from_filename(filename)
-            if not delivery_number:
-                continue
-
-            # Try each month sheet until we find a row
-            seen_sheets = set()
-            for month_name in month_candidates:
-                if month_name in seen_sheets:
-                    continue
-                seen_sheets.add(month_name)
-
-                sheet_id = find_sheet_id_by_name_in_workspace(_RESOLVED_WORKSPACE_ID, month_name)
-                if not sheet_id:
-                    continue
-                row_id = find_row_by_delivery_number(sheet_id, delivery_number)
-                if row_id:
-                    delivery_matches.append({
-                        "delivery_number": delivery_number,
-                        "file": filename,
-                        "sheet_name": month_name,
-                        "sheet_id": sheet_id,
-                        "row_id": row_id
-                    })
-                    break  # stop after first hit for this file
+            match = find_delivery_match(filename, month_candidates)
+            if match:
+                delivery_matches.append(match)
 
         session['matches'] = delivery_matches
         flash(f"Found {len(delivery_matches)} matching delivery number(s).")
@@ -746,28 +1313,31 @@ def smartsheet_match():
     delivery_matches = session.get('matches', [])
     return render_template("matches.html", matches=delivery_matches)
 
-@app.route('/upload_match/<sheet_id>/<row_id>/<filename>', methods=['POST'])
+@app.route('/upload_match/<sheet_id>/<row_id>/<path:filename>', methods=['POST'])
 def upload_match(sheet_id, row_id, filename):
     if not ss_client:
         flash("Smartsheet is not configured. Set SMARTSHEET_API in your .env.")
         return redirect(url_for('smartsheet_match'))
 
-    file_path = os.path.join(OUTPUT_FOLDER, filename)
-    if not os.path.exists(file_path):
-        flash(f"File {filename} not found.")
+    # filename is "<batch_id>/<name>.pdf" relative to OUTPUT_FOLDER; only the name goes to Smartsheet
+    file_path = safe_join(OUTPUT_FOLDER, filename)
+    attach_name = os.path.basename(filename)
+    if not file_path or not os.path.exists(file_path):
+        flash(f"File {attach_name} not found.")
         return redirect(url_for('smartsheet_match'))
 
     try:
-        with open(file_path, 'rb') as fh:
-            ss_client.Attachments.attach_file_to_row(
-                int(sheet_id),
-                int(row_id),
-                (filename, fh, 'application/pdf')
-            )
-        flash(f"Uploaded {filename} to Smartsheet.")
+        if row_has_attachment(sheet_id, row_id, attach_name, file_size_in_kb(file_path)):
+            flash(f"{attach_name} is already attached to that row.")
+            return redirect(url_for('smartsheet_match'))
+        attach_pdf_to_row(sheet_id, row_id, file_path, attach_name)
+        row_writer = RowStatusWriter()
+        row_writer.add(sheet_id, row_id, attach_name)
+        row_writer.flush()
+        flash(f"Uploaded {attach_name} to Smartsheet.")
     except Exception as e:
         logging.exception("Smartsheet upload failed")
-        flash(f"Smartsheet upload failed for {filename}: {e}")
+        flash(f"Smartsheet upload failed for {attach_name}: {e}")
     return redirect(url_for('smartsheet_match'))
 
 @app.route('/upload_all_matches', methods=['POST'])
@@ -785,25 +1355,31 @@ def upload_all_matches():
 
     def generate():
         uploaded = 0
+        attachment_index = AttachmentIndex()
+        row_writer = RowStatusWriter()
         for m in matches:
             file_path = os.path.join(OUTPUT_FOLDER, m["file"])
+            attach_name = os.path.basename(m["file"])
             if not os.path.exists(file_path):
                 logging.warning(f"File not found: {m['file']}")
                 continue
             try:
-                with open(file_path, 'rb') as fh:
-                    ss_client.Attachments.attach_file_to_row(
-                        int(m["sheet_id"]),
-                        int(m["row_id"]),
-                        (m["file"], fh, 'application/pdf')
-                    )
+                if attachment_index.has(m["sheet_id"], m["row_id"], attach_name, file_size_in_kb(file_path)):
+                    logging.info(f"{m['file']} already attached (sheet {m['sheet_id']}, row {m['row_id']}); skipping")
+                else:
+                    attach_pdf_to_row(m["sheet_id"], m["row_id"], file_path, attach_name, attachment_index)
+                    row_writer.add(m["sheet_id"], m["row_id"], attach_name)
+                    logging.info(f"Uploaded {m['file']} to Smartsheet (sheet {m['sheet_id']}, row {m['row_id']})")
                 uploaded += 1
-                logging.info(f"Uploaded {m['file']} to Smartsheet (sheet {m['sheet_id']}, row {m['row_id']})")
             except Exception as e:
                 logging.exception(f"Smartsheet upload failed for {m['file']}: {e}")
                 continue
             yield f'{{"progress": {uploaded}, "total": {total}}}\n'
 
+        updated, failed = row_writer.flush()
+        logging.info(f"Row status write-back: {updated} updated, {failed} failed in {row_writer.calls} call(s)")
+        yield f'{{"progress": {uploaded}, "total": {total}, "rows_updated": {updated}, "rows_failed": {failed}}}\n'
+
     return Response(stream_with_context(generate()), mimetype='text/plain')
 
 # ============================================================================
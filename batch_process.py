@@ -0,0 +1,289 @@
+# batch_process.py
+"""
+Headless bulk processing of POD PDFs (backfills) without going through the Flask UI.
+
+Each input PDF is split/OCR'd with app.process_pdf in a pool of worker processes;
+the resulting pages are matched to Smartsheet rows and attached from the parent process.
+
+Examples:
+    python batch_process.py "/archive/2025-08/*.pdf" --workers 4 --summary august.csv
+    python batch_process.py /archive/2025-08 --dry-run --summary august.json
+    python batch_process.py /archive/2025-08 --checkpoint august.ckpt.jsonl   # re-run to resume
+"""
+import os
+import sys
+import csv
+import json
+import glob
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import app as pod_app
+
+SUMMARY_FIELDS = ["input", "file", "delivery_number", "sheet_name", "sheet_id", "row_id", "status", "message"]
+# Outcomes worth retrying on a re-run (e.g. with the right --months), so inputs with them are not checkpointed.
+RETRY_STATUSES = {"failed", "unmatched", "no_delivery"}
+# Inputs with matched rows are checkpointed after their row status updates are written, this many at a time.
+CHECKPOINT_EVERY = 25
+
+
+def collect_inputs(patterns: list[str], recursive: bool = False) -> list[str]:
+    """Expand directories and glob patterns into a sorted, de-duplicated list of PDF paths."""
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*") if recursive else os.path.join(pattern, "*")
+        for path in glob.glob(pattern, recursive=recursive):
+            if os.path.isfile(path) and path.lower().endswith(".pdf"):
+                found.add(os.path.abspath(path))
+    return sorted(found)
+
+
+class Checkpoint:
+    """
+    Append-only JSON-lines record of inputs that finished processing.
+    One line per input PDF, so an interrupted run can be resumed by re-running the same command.
+    Records are keyed by input path unless an explicit key (e.g. a content hash) is given.
+    """
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.done = {}
+        if path and os.path.exists(path):
+            with open(path) as fh:
+                for line in fh:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a killed run; that input is simply redone.
+                        continue
+                    self.done[record.get("key", record["input"])] = record
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.done
+
+    def record(self, input_path: str, outcomes: list[dict], key: str | None = None):
+        record = {"input": input_path, "finished_at": datetime.utcnow().isoformat(), "outcomes": outcomes}
+        if key:
+            record["key"] = key
+        self.done[key or input_path] = record
+        if not self.path:
+            return
+        with open(self.path, "a") as fh:
+            fh.write(json.dumps(record) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+def _init_worker(output_dir: str, log_level: int):
+    pod_app.use_output_folder(output_dir)
+    logging.getLogger().setLevel(log_level)
+
+
+def _split_worker(pdf_path: str, batch_id: str):
+    """
+    Runs in a worker process: split/OCR one PDF into the batch's output directory and return the
+    saved page paths ("<batch_id>/<name>.pdf"). The storage manager suffixes same-named pages
+    from different inputs instead of overwriting them.
+    """
+    return pdf_path, pod_app.process_pdf(pdf_path, batch_id)
+
+
+def match_and_attach(input_path: str, saved_files: list[str], month_candidates: list[str],
+                     lookup_cache: dict, attachment_index: "pod_app.AttachmentIndex",
+                     row_writer: "pod_app.RowStatusWriter", dry_run: bool = False) -> list[dict]:
+    """
+    Match each split page to a Smartsheet row and attach it, skipping files already attached
+    to that row. saved_files are paths relative to OUTPUT_FOLDER; only the file name is attached.
+    Row status updates are queued on row_writer; the caller flushes it.
+    Returns one outcome dict per page.
+    """
+    if not saved_files:
+        return [{"input": input_path, "file": None, "status": "no_pages",
+                 "message": "No customer pages detected"}]
+
+    outcomes = []
+    for filename in saved_files:
+        outcome = {"input": input_path, "file": filename}
+        attach_name = os.path.basename(filename)
+        if not pod_app.extract_delivery_from_filename(attach_name):
+            outcome.update(status="no_delivery", message="No delivery number in output filename")
+            outcomes.append(outcome)
+            continue
+        try:
+            match = pod_app.find_delivery_match(filename, month_candidates, lookup_cache)
+        except Exception as e:
+            logging.exception(f"Smartsheet lookup failed for {filename}")
+            outcome.update(status="failed", message=f"Lookup failed: {e}")
+            outcomes.append(outcome)
+            continue
+
+        if not match:
+            outcome.update(status="unmatched", message="No matching row found")
+            outcomes.append(outcome)
+            continue
+
+        outcome.update({k: match[k] for k in ("delivery_number", "sheet_name", "sheet_id", "row_id")})
+        file_path = os.path.join(pod_app.OUTPUT_FOLDER, filename)
+        if attachment_index.has(match["sheet_id"], match["row_id"], attach_name, pod_app.file_size_in_kb(file_path)):
+            outcome.update(status="already_attached", message=f"Already attached on row {match['row_id']}")
+            if match.get("pod_received") is False and not dry_run:
+                # Attached by an earlier run whose row status write-back failed or never ran
+                row_writer.add(match["sheet_id"], match["row_id"], attach_name)
+                lookup_cache[("received", match["sheet_id"])].add(match["row_id"])
+                outcome["message"] += "; row status update queued"
+        elif dry_run:
+            outcome.update(status="matched", message="Dry run: not attached")
+        else:
+            try:
+                pod_app.attach_pdf_to_row(match["sheet_id"], match["row_id"], file_path, attach_name,
+                                          attachment_index)
+                row_writer.add(match["sheet_id"], match["row_id"], attach_name)
+                if match.get("pod_received") is False:
+                    lookup_cache[("received", match["sheet_id"])].add(match["row_id"])
+                outcome.update(status="attached", message=f"Uploaded to {match['sheet_name']} (row {match['row_id']})")
+            except Exception as e:
+                logging.exception(f"Attach failed for {filename}")
+                outcome.update(status="failed", message=f"Attach failed: {e}")
+        outcomes.append(outcome)
+    return outcomes
+
+
+def write_summary(path: str, outcomes: list[dict]):
+    """Write per-page outcomes as CSV (if path ends with .csv) or JSON."""
+    if path.lower().endswith(".csv"):
+        with open(path, "w", newline="") as fh:
+            writer = csv.DictWriter(fh, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for outcome in outcomes:
+                writer.writerow(outcome)
+    else:
+        counts = {}
+        for outcome in outcomes:
+            counts[outcome["status"]] = counts.get(outcome["status"], 0) + 1
+        with open(path, "w") as fh:
+            json.dump({"counts": counts, "outcomes": outcomes}, fh, indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Split, match and attach POD PDFs in bulk.")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Recurse into directories / honour ** in globs")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of split/OCR worker processes (default: CPU count)")
+    parser.add_argument("-o", "--output-dir", default=pod_app.OUTPUT_FOLDER,
+                        help=f"Root under which each run's split pages get a batch directory "
+                             f"(default: {pod_app.OUTPUT_FOLDER})")
+    parser.add_argument("--checkpoint", help="JSON-lines checkpoint file; inputs already recorded there are skipped")
+    parser.add_argument("--summary", help="Write per-page outcomes to this .json or .csv file")
+    parser.add_argument("--months", nargs="+", metavar="SHEET",
+                        help="Month sheet names to search (default: the month in each input's YYYYMMDD "
+                             "filename token, plus the current and previous month)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Split and match but do not attach anything or write the checkpoint")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log page text and per-file details")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    logging.getLogger().setLevel(log_level)
+
+    if not pod_app.ss_client:
+        print("SMARTSHEET_API is not set; cannot match against Smartsheet.", file=sys.stderr)
+        return 2
+    if pod_app.resolve_workspace_id() is None:
+        print(f"Workspace '{pod_app.WORKSPACE_NAME}' not found or not shared with this API user.", file=sys.stderr)
+        return 2
+
+    pod_app.use_output_folder(args.output_dir)
+    # One output batch per run: same-named pages from different inputs get -2, -3... suffixes,
+    # and the web app's storage cleanup accounts for and evicts the run's pages like any batch.
+    batch_id = pod_app.storage.new_batch_id()
+
+    inputs = collect_inputs(args.inputs, args.recursive)
+    checkpoint = Checkpoint(None if args.dry_run else args.checkpoint)
+    pending = [p for p in inputs if p not in checkpoint]
+    print(f"{len(inputs)} PDF(s) found, {len(inputs) - len(pending)} already done, {len(pending)} to process.")
+
+    lookup_cache = {}
+    attachment_index = pod_app.AttachmentIndex()
+    row_writer = pod_app.RowStatusWriter()
+    outcomes = []
+    for record in checkpoint.done.values():
+        if record["input"] in inputs:
+            outcomes.extend(record["outcomes"])
+
+    awaiting_rows = []  # (input, outcomes) to checkpoint once their row updates are written
+    not_marked = []
+
+    def checkpoint_written():
+        row_writer.flush()
+        for input_path, file_outcomes in awaiting_rows:
+            # A row whose status update failed keeps its input out of the checkpoint; on a re-run
+            # the page is already attached, and its unmarked row is queued again.
+            if any(row_writer.unwritten(o["sheet_id"], o["row_id"]) for o in file_outcomes if o.get("row_id")):
+                not_marked.append(input_path)
+            else:
+                checkpoint.record(input_path, file_outcomes)
+        awaiting_rows.clear()
+
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_init_worker,
+                                 initargs=(args.output_dir, log_level)) as pool:
+            futures = {pool.submit(_split_worker, p, batch_id): p for p in pending}
+            for n, future in enumerate(as_completed(futures), 1):
+                try:
+                    input_path, saved_files = future.result()
+                except Exception as e:
+                    # Not checkpointed, so the next run retries this input.
+                    logging.exception("Split worker failed")
+                    print(f"[{n}/{len(pending)}] {os.path.basename(futures[future])}: worker error: {e}", file=sys.stderr)
+                    continue
+                months = args.months or pod_app.pick_month_candidates_from_filename(input_path)
+                file_outcomes = match_and_attach(input_path, saved_files, months, lookup_cache,
+                                                 attachment_index, row_writer, args.dry_run)
+                # Inputs with a failed, unmatched or unnamed page stay out of the checkpoint so a re-run
+                # (perhaps with --months) retries them; pages that did attach are skipped then via the index.
+                retry = any(o["status"] in RETRY_STATUSES for o in file_outcomes)
+                if not retry and any(o.get("row_id") for o in file_outcomes) and not args.dry_run:
+                    awaiting_rows.append((input_path, file_outcomes))
+                    if len(awaiting_rows) >= CHECKPOINT_EVERY:
+                        checkpoint_written()
+                elif not retry:
+                    checkpoint.record(input_path, file_outcomes)
+                outcomes.extend(file_outcomes)
+                statuses = ", ".join(o["status"] for o in file_outcomes)
+                print(f"[{n}/{len(pending)}] {os.path.basename(input_path)}: {statuses}")
+    finally:
+        # Mark rows for everything attached so far, even if the run is interrupted
+        checkpoint_written()
+    updated, failed = row_writer.updated, row_writer.failed
+    if updated or failed:
+        print(f"Row status updates: {updated} written, {failed} failed, in {row_writer.calls} API call(s)")
+    if row_writer.pending:
+        print(f"{row_writer.pending} row status update(s) not written: sheet columns could not be read",
+              file=sys.stderr)
+    if not_marked:
+        print(f"{len(not_marked)} input(s) left out of the checkpoint because their row status update failed; "
+              f"re-run to retry", file=sys.stderr)
+
+    if args.summary:
+        write_summary(args.summary, outcomes)
+        print(f"Summary written to {args.summary}")
+
+    counts = {}
+    for outcome in outcomes:
+        counts[outcome["status"]] = counts.get(outcome["status"], 0) + 1
+    print("Totals: " + ", ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+    return 1 if counts.get("failed") or not_marked else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,441 @@
+# loadtest.py
+"""
+Local HTTP load-test harness for the Flask app.
+
+Boots the real app under gunicorn with in-memory fake Smartsheet and Gmail backends (no network,
+no credentials) and drives a mixed operator workload against it: PDF uploads, Smartsheet matching,
+bulk attach, and Gmail jobs with progress polling. Reports throughput, error rate and latency
+percentiles per route, optionally for several gunicorn worker/thread layouts in one go.
+
+Uploaded PDFs carry a text layer, so no Tesseract time is included; use --ocr-pages to add
+image-only pages when OCR cost should be part of the measurement.
+
+Examples:
+    python loadtest.py --users 20 --duration 60
+    python loadtest.py --users 30 --duration 45 --configs 2x1 4x1 2x4 4x4 --json results.json
+    python loadtest.py --mix upload=1,match=1,upload_all=1,email=0
+"""
+import os
+import sys
+import io
+import json
+import time
+import base64
+import random
+import signal
+import socket
+import argparse
+import threading
+import subprocess
+from contextlib import nullcontext
+from datetime import datetime
+from types import SimpleNamespace
+
+import requests
+
+LOADTEST_PASSWORD = "loadtest"
+DEFAULT_MIX = "upload=4,match=3,upload_all=1,email=1"
+CUSTOMERS = ["Catalina", "Econo Gas", "Fuel It", "Rav Petroleum", "Petrole Leger"]
+
+
+def delivery_numbers(count: int) -> list[str]:
+    return [str(10000000 + i * 7919) for i in range(count)]
+
+
+def make_pod_pdf(deliveries: list[str], ocr_pages: int = 0) -> bytes:
+    """A multi-page POD PDF whose pages each name a known customer and delivery number."""
+    import fitz
+    doc = fitz.open()
+    for i, delivery in enumerate(deliveries):
+        page = doc.new_page()
+        # Printed ticket numbers carry a trailing digit; extract_po_delivery keeps the first 8 digits
+        page.insert_text((72, 72), f"{CUSTOMERS[i % len(CUSTOMERS)]}\nProof of delivery\nTicket # {delivery}{i % 10}",
+                         fontsize=12)
+    for _ in range(ocr_pages):
+        doc.new_page()  # blank image-less page: forces the OCR path
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+# ===================== Fake backends (installed inside each gunicorn worker) =====================
+
+class FakeSmartsheet:
+    """Just enough of the Smartsheet SDK surface used by app.py, with simulated API latency."""
+
+    def __init__(self, deliveries: list[str], latency: float):
+        self.latency = latency
+        month = datetime.now().strftime('%B %Y')
+        delivery_col = SimpleNamespace(id=1, title="Delivery #")
+        self._columns = [delivery_col, SimpleNamespace(id=2, title="POD Received"),
+                         SimpleNamespace(id=3, title="POD Received At"), SimpleNamespace(id=4, title="POD Source File")]
+        rows = [SimpleNamespace(id=1000 + i, cells=[SimpleNamespace(column_id=1, display_value=d)])
+                for i, d in enumerate(deliveries)]
+        self._sheet = SimpleNamespace(id=42, name=month, columns=self._columns, rows=rows)
+        self._attachments = []
+        self._lock = threading.Lock()
+        self.Workspaces = SimpleNamespace(list_workspaces=self._list_workspaces, get_workspace=self._get_workspace)
+        self.Sheets = SimpleNamespace(get_sheet=self._get_sheet, get_columns=self._get_columns,
+                                      update_rows_with_partial_success=self._update_rows)
+        self.Attachments = SimpleNamespace(
+            list_all_attachments=self._list_all_attachments,
+            list_row_attachments=self._list_row_attachments,
+            attach_file_to_row=self._attach_file_to_row,
+        )
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(random.uniform(0.5, 1.5) * self.latency)
+
+    def _list_workspaces(self, page=None):
+        self._wait()
+        return SimpleNamespace(data=[SimpleNamespace(id=7, name="Test PODS")], next_page=None)
+
+    def _get_workspace(self, workspace_id):
+        self._wait()
+        return SimpleNamespace(id=workspace_id, sheets=[self._sheet])
+
+    def _get_sheet(self, sheet_id, **kwargs):
+        self._wait()
+        return self._sheet
+
+    def _get_columns(self, sheet_id, **kwargs):
+        self._wait()
+        return SimpleNamespace(data=self._columns)
+
+    def _update_rows(self, sheet_id, rows):
+        self._wait()
+        return SimpleNamespace(message="SUCCESS", result=rows)
+
+    def _list_all_attachments(self, sheet_id, page_size=None, page=None, include_all=None):
+        self._wait()
+        with self._lock:
+            return SimpleNamespace(data=list(self._attachments))
+
+    def _list_row_attachments(self, sheet_id, row_id, **kwargs):
+        self._wait()
+        with self._lock:
+            return SimpleNamespace(data=[a for a in self._attachments if a.parent_id == row_id])
+
+    def _attach_file_to_row(self, sheet_id, row_id, file_tuple):
+        name, fh, _mime = file_tuple
+        size = len(fh.read())
+        self._wait()
+        with self._lock:
+            # Keep memory bounded over long runs; idempotency checks only need recent entries.
+            self._attachments = self._attachments[-5000:]
+            self._attachments.append(SimpleNamespace(parent_type="ROW", parent_id=row_id, name=name,
+                                                     size_in_kb=-(-size // 1024)))
+        return SimpleNamespace(message="SUCCESS")
+
+
+class _Call:
+    def __init__(self, fn, latency):
+        self.fn, self.latency = fn, latency
+
+    def execute(self):
+        if self.latency:
+            time.sleep(random.uniform(0.5, 1.5) * self.latency)
+        return self.fn()
+
+
+class FakeGmail:
+    """users().messages().list/get and attachments().get over a fixed set of POD emails."""
+
+    def __init__(self, deliveries: list[str], messages: int, latency: float):
+        self.latency = latency
+        today = datetime.now().strftime('%Y%m%d')
+        self._messages = {}
+        for i in range(messages):
+            delivery = deliveries[i % len(deliveries)]
+            data = base64.urlsafe_b64encode(make_pod_pdf([delivery])).decode()
+            self._messages[f"m{i}"] = {
+                "payload": {"parts": [{"filename": f"{i + 1}.Oleo_POD__{delivery}_{today}.pdf",
+                                       "body": {"attachmentId": f"a{i}"}}]},
+                "data": data,
+            }
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def attachments(self):
+        return self
+
+    def list(self, userId, q=None, pageToken=None):
+        return _Call(lambda: {"messages": [{"id": m} for m in self._messages]}, self.latency)
+
+    def get(self, userId, id, messageId=None):
+        if messageId is not None:
+            return _Call(lambda: {"data": self._messages[messageId]["data"]}, self.latency)
+        return _Call(lambda: {"payload": self._messages[id]["payload"]}, self.latency)
+
+
+def install_fakes(pod_app, deliveries: list[str], gmail_messages: int, latency: float):
+    fake_ss = FakeSmartsheet(deliveries, latency)
+    fake_gmail = FakeGmail(deliveries, gmail_messages, latency)
+    pod_app.ss_client = fake_ss
+    pod_app.gmail_service = lambda: nullcontext(fake_gmail)
+    pod_app.UPLOAD_PASSWORD = LOADTEST_PASSWORD
+
+
+def serve(args):
+    """Run the app under gunicorn with fake backends (invoked as a subprocess by the driver)."""
+    from gunicorn.app.base import BaseApplication
+
+    class PodLoadTestApp(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"127.0.0.1:{args.port}")
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("threads", args.threads)
+            self.cfg.set("timeout", 120)
+            self.cfg.set("loglevel", "warning")
+
+        def load(self):
+            import logging
+            import app as pod_app
+            logging.getLogger().setLevel(logging.WARNING)
+            install_fakes(pod_app, delivery_numbers(args.deliveries), args.gmail_messages, args.backend_latency)
+            return pod_app.app
+
+    PodLoadTestApp().run()
+
+
+# ===================== Load driver =====================
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # route -> list of (latency_s, ok)
+        self._lock = threading.Lock()
+
+    def add(self, route: str, latency: float, ok: bool):
+        with self._lock:
+            self.samples.setdefault(route, []).append((latency, ok))
+
+    def report(self, duration: float) -> dict:
+        def pct(sorted_vals, p):
+            if not sorted_vals:
+                return 0.0
+            k = min(len(sorted_vals) - 1, int(round(p / 100 * (len(sorted_vals) - 1))))
+            return sorted_vals[k]
+
+        out = {}
+        for route, samples in sorted(self.samples.items()):
+            lat = sorted(s[0] for s in samples)
+            errors = sum(1 for s in samples if not s[1])
+            out[route] = {
+                "requests": len(samples),
+                "rps": len(samples) / duration if duration else 0.0,
+                "error_rate": errors / len(samples),
+                "p50_ms": pct(lat, 50) * 1000,
+                "p90_ms": pct(lat, 90) * 1000,
+                "p99_ms": pct(lat, 99) * 1000,
+                "max_ms": lat[-1] * 1000,
+            }
+        return out
+
+
+class VirtualUser(threading.Thread):
+    """One operator session looping over weighted actions until the deadline."""
+
+    def __init__(self, base_url: str, mix: dict, pdfs: list[bytes], recorder: Recorder, deadline: float,
+                 think_time: float):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.actions = list(mix)
+        self.weights = [mix[a] for a in self.actions]
+        self.pdfs = pdfs
+        self.recorder = recorder
+        self.deadline = deadline
+        self.think_time = think_time
+        self.session = requests.Session()
+        self.has_upload = False
+        self.has_matches = False
+
+    def _request(self, route: str, method: str, path: str, ok_statuses=(200, 202, 302), **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, self.base_url + path, allow_redirects=False, timeout=150, **kwargs)
+            if kwargs.get("stream"):
+                for _ in resp.iter_content(chunk_size=None):
+                    pass
+            ok = resp.status_code in ok_statuses
+        except requests.RequestException:
+            resp, ok = None, False
+        self.recorder.add(route, time.perf_counter() - start, ok)
+        # Session timed out (15 min) or was lost: log in again
+        if route != "POST /login" and resp is not None and (
+                resp.status_code == 401 or resp.headers.get("Location", "").endswith("/login")):
+            self.login()
+        return resp
+
+    def login(self):
+        self._request("POST /login", "POST", "/login", data={"password": LOADTEST_PASSWORD})
+
+    def upload(self):
+        pdf = random.choice(self.pdfs)
+        resp = self._request("POST /", "POST", "/", files={"pdf_file": ("pods.pdf", io.BytesIO(pdf), "application/pdf")})
+        self.has_upload = resp is not None and resp.status_code == 200
+
+    def match(self):
+        if not self.has_upload:
+            return self.upload()
+        self._request("POST /smartsheet_match", "POST", "/smartsheet_match")
+        self._request("GET /smartsheet_match", "GET", "/smartsheet_match")
+        self.has_matches = True
+
+    def upload_all(self):
+        if not self.has_matches:
+            return self.match()
+        self._request("POST /upload_all_matches", "POST", "/upload_all_matches", stream=True)
+
+    def email(self):
+        resp = self._request("POST /start_check_pod_emails", "POST", "/start_check_pod_emails")
+        if resp is None or resp.status_code != 202:
+            return
+        job_id = resp.json()["job_id"]
+        while time.time() < self.deadline:
+            resp = self._request("GET /progress/<job_id>", "GET", f"/progress/{job_id}")
+            if resp is None or resp.status_code != 200 or resp.json().get("done"):
+                return
+            time.sleep(1.0)  # matches the UI's polling interval
+
+    def run(self):
+        self.login()
+        while time.time() < self.deadline:
+            getattr(self, random.choices(self.actions, self.weights)[0])()
+            if self.think_time:
+                time.sleep(random.uniform(0, 2 * self.think_time))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_server(base_url: str, proc: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {proc.returncode}")
+        try:
+            requests.get(base_url + "/login", timeout=2)
+            return
+        except requests.RequestException:
+            time.sleep(0.3)
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def run_config(args, workers: int, threads: int, pdfs: list[bytes], mix: dict) -> dict:
+    port = _free_port()
+    cmd = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+           "--workers", str(workers), "--threads", str(threads),
+           "--deliveries", str(args.deliveries), "--gmail-messages", str(args.gmail_messages),
+           "--backend-latency", str(args.backend_latency)]
+    proc = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)))
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_for_server(base_url, proc)
+        recorder = Recorder()
+        start = time.time()
+        deadline = start + args.duration
+        users = [VirtualUser(base_url, mix, pdfs, recorder, deadline, args.think_time) for _ in range(args.users)]
+        for user in users:
+            user.start()
+            if args.ramp_up:
+                time.sleep(args.ramp_up / len(users))
+        for user in users:
+            user.join()
+        return recorder.report(time.time() - start)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def print_report(label: str, report: dict):
+    print(f"\n== {label} ==")
+    print(f"{'route':<30} {'reqs':>7} {'req/s':>8} {'err%':>6} {'p50ms':>8} {'p90ms':>8} {'p99ms':>8} {'maxms':>8}")
+    for route, r in report.items():
+        print(f"{route:<30} {r['requests']:>7} {r['rps']:>8.2f} {r['error_rate'] * 100:>6.1f} "
+              f"{r['p50_ms']:>8.0f} {r['p90_ms']:>8.0f} {r['p99_ms']:>8.0f} {r['max_ms']:>8.0f}")
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ("upload", "match", "upload_all", "email"):
+            raise argparse.ArgumentTypeError(f"unknown action '{name}'")
+        if float(weight or 1) > 0:
+            mix[name] = float(weight or 1)
+    if not mix:
+        raise argparse.ArgumentTypeError("mix needs at least one action with weight > 0")
+    return mix
+
+
+def parse_config(text: str) -> tuple[int, int]:
+    workers, _, threads = text.lower().partition("x")
+    try:
+        return int(workers), int(threads or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"config must look like WORKERSxTHREADS, got '{text}'")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the POD Flask app against fake backends.")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent virtual operators (default: 10)")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run each configuration (default: 60)")
+    parser.add_argument("--ramp-up", type=float, default=5, help="Seconds over which users start (default: 5)")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Mean pause between actions, seconds (default: 0.5)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Action weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--configs", nargs="+", type=parse_config, default=[(2, 1)], metavar="WxT",
+                        help="gunicorn workers x threads layouts to compare, e.g. 2x1 4x4 (default: 2x1)")
+    parser.add_argument("--pages", type=int, default=5, help="Pages per uploaded PDF (default: 5)")
+    parser.add_argument("--ocr-pages", type=int, default=0, help="Extra image-only pages per PDF (default: 0)")
+    parser.add_argument("--deliveries", type=int, default=200, help="Rows in the fake month sheet (default: 200)")
+    parser.add_argument("--gmail-messages", type=int, default=10, help="Emails returned by the fake Gmail (default: 10)")
+    parser.add_argument("--backend-latency", type=float, default=0.15,
+                        help="Mean simulated Smartsheet/Gmail API latency in seconds (default: 0.15)")
+    parser.add_argument("--json", help="Also write all results to this JSON file")
+    # Internal: run the server side
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--workers", type=int, default=2, help=argparse.SUPPRESS)
+    parser.add_argument("--threads", type=int, default=1, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve:
+        serve(args)
+        return 0
+
+    deliveries = delivery_numbers(args.deliveries)
+    pdfs = [make_pod_pdf(random.sample(deliveries, min(args.pages, len(deliveries))), args.ocr_pages)
+            for _ in range(10)]
+
+    results = {}
+    for workers, threads in args.configs:
+        label = f"{workers} workers x {threads} threads, {args.users} users, {args.duration:.0f}s"
+        report = run_config(args, workers, threads, pdfs, args.mix)
+        results[f"{workers}x{threads}"] = report
+        print_report(label, report)
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+        print(f"\nResults written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
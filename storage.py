@@ -0,0 +1,360 @@
+# storage.py
+"""
+Disk layout and housekeeping for uploaded and generated PDFs.
+
+Every upload gets its own batch directory under the upload and output roots, so concurrent uploads
+of files with the same name never overwrite each other:
+
+    /tmp/uploads/<batch_id>/<original name>.pdf
+    /tmp/outputs/<batch_id>/<split page>.pdf   -> hardlink to /tmp/outputs/.blobs/<sha256>.pdf
+
+Split pages are stored once per content hash and hardlinked into each batch, so re-uploading the
+same POD costs no extra space. A background thread (started by the web app only) evicts batches past
+their maximum age, then the least recently used batches until usage is under quota; a lock file in the
+output root keeps several gunicorn workers from evicting at the same time.
+
+Resumable upload state and per-file processing results are kept as small dot-files inside the upload
+batch directory rather than in memory, so any gunicorn worker can accept the next chunk or answer a
+status poll for a batch.
+"""
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import threading
+import uuid
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+BLOB_DIR_NAME = ".blobs"
+CLEANUP_LOCK_NAME = ".cleanup.lock"
+
+
+class StorageManager:
+    def __init__(self, upload_root: str, output_root: str, quota_bytes: int, max_age_seconds: int,
+                 min_age_seconds: int = 900, cleanup_interval: int = 600, min_free_bytes: int = 0):
+        self.upload_root = upload_root
+        self.output_root = output_root
+        self.blob_root = os.path.join(output_root, BLOB_DIR_NAME)
+        self.quota_bytes = quota_bytes
+        self.max_age_seconds = max_age_seconds
+        # Batches touched more recently than this are never evicted (covers a live session).
+        self.min_age_seconds = min_age_seconds
+        self.cleanup_interval = cleanup_interval
+        # New uploads are refused if they would leave less than this free on the upload filesystem.
+        self.min_free_bytes = min_free_bytes
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.cleanup_lock_path = os.path.join(output_root, CLEANUP_LOCK_NAME)
+        for path in (upload_root, output_root, self.blob_root):
+            os.makedirs(path, exist_ok=True)
+
+    # ----- batches -----
+
+    @staticmethod
+    def new_batch_id() -> str:
+        return f"{datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+    def upload_path(self, batch_id: str, filename: str) -> str:
+        """
+        Local path for an uploaded file inside its batch directory (name is sanitised).
+        A second file with the same name in one batch gets a numbered suffix instead of overwriting.
+        """
+        batch_dir = os.path.join(self.upload_root, secure_filename(batch_id))
+        os.makedirs(batch_dir, exist_ok=True)
+        name = secure_filename(filename) or f"upload-{uuid.uuid4().hex[:8]}.pdf"
+        stem, ext = os.path.splitext(name)
+        candidate, n = name, 1
+        # O_EXCL reservation so concurrent requests for the same name cannot both win
+        while True:
+            try:
+                os.close(os.open(os.path.join(batch_dir, candidate), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return os.path.join(batch_dir, candidate)
+            except FileExistsError:
+                n += 1
+                candidate = f"{stem}-{n}{ext}"
+
+    def output_dir(self, batch_id: str) -> str:
+        batch_dir = os.path.join(self.output_root, secure_filename(batch_id))
+        os.makedirs(batch_dir, exist_ok=True)
+        return batch_dir
+
+    def touch_batch(self, batch_id: str):
+        """Mark a batch as recently used so quota eviction picks older batches first."""
+        for root in (self.output_root, self.upload_root):
+            path = os.path.join(root, secure_filename(batch_id))
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+    # ----- content-addressed outputs -----
+
+    def store_output(self, batch_id: str, filename: str, data: bytes) -> str:
+        """
+        Store an output PDF for a batch, reusing an identical existing file by hardlink.
+        Returns the path relative to the output root ("<batch_id>/<filename>").
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = os.path.join(self.blob_root, digest + ".pdf")
+        if not os.path.exists(blob_path):
+            tmp_path = f"{blob_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp_path, blob_path)
+        else:
+            logging.info(f"Reusing stored copy of {filename} ({digest[:12]})")
+
+        batch_dir = self.output_dir(batch_id)
+        stem, ext = os.path.splitext(filename)
+        target, n = os.path.join(batch_dir, filename), 1
+        while True:
+            try:
+                try:
+                    os.link(blob_path, target)
+                except FileExistsError:
+                    raise
+                except OSError:
+                    # Filesystem without hardlinks (or the blob was just evicted): fall back to a plain copy.
+                    with open(target, "xb") as fh:
+                        fh.write(data)
+                return os.path.relpath(target, self.output_root)
+            except FileExistsError:
+                if os.path.samefile(target, blob_path):
+                    # Same page already in this batch (e.g. the same PDF uploaded twice)
+                    return os.path.relpath(target, self.output_root)
+                # Another file in the batch produced the same name with different content
+                n += 1
+                target = os.path.join(batch_dir, f"{stem}-{n}{ext}")
+
+    # ----- resumable uploads -----
+
+    def _upload_meta_path(self, batch_id: str, upload_id: str) -> str:
+        return os.path.join(self.upload_root, secure_filename(batch_id), f".{secure_filename(upload_id)}.upload.json")
+
+    def has_room(self, size: int) -> bool:
+        """True if `size` more bytes fit on the upload filesystem while keeping min_free_bytes free."""
+        return shutil.disk_usage(self.upload_root).free - size >= self.min_free_bytes
+
+    def create_upload(self, batch_id: str, filename: str, size: int) -> dict:
+        """Reserve a file name in the batch and record the expected size for a chunked upload."""
+        path = self.upload_path(batch_id, filename)
+        meta = {"upload_id": uuid.uuid4().hex, "batch_id": batch_id,
+                "filename": os.path.basename(path), "size": int(size)}
+        _write_json(self._upload_meta_path(batch_id, meta["upload_id"]), meta)
+        return self.upload_state(batch_id, meta["upload_id"])
+
+    def upload_state(self, batch_id: str, upload_id: str) -> dict | None:
+        """Upload metadata plus the current byte offset, or None if the upload is unknown."""
+        meta = _read_json(self._upload_meta_path(batch_id, upload_id))
+        if meta is None:
+            return None
+        final_path = os.path.join(self.upload_root, secure_filename(batch_id), meta["filename"])
+        try:
+            offset = os.path.getsize(final_path + ".part")
+            complete = False
+        except FileNotFoundError:
+            # The reserved (empty) final file exists until the first chunk creates the .part file
+            complete = os.path.getsize(final_path) == meta["size"] if os.path.exists(final_path) else False
+            offset = meta["size"] if complete else 0
+        return {**meta, "offset": offset, "complete": complete, "path": final_path}
+
+    def append_chunk(self, batch_id: str, upload_id: str, offset: int, stream, chunk_size: int = 1024 * 1024) -> dict:
+        """
+        Stream a chunk starting at `offset` to disk. Raises KeyError for an unknown upload,
+        ValueError if the offset doesn't match what is on disk, BlockingIOError if another
+        request is writing the same upload. The returned state has just_completed=True once,
+        when the final byte lands and the file is moved into place.
+        """
+        state = self.upload_state(batch_id, upload_id)
+        if state is None:
+            raise KeyError(upload_id)
+        if state["complete"]:
+            return {**state, "just_completed": False}
+
+        part_path = state["path"] + ".part"
+        with open(part_path, "ab") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.path.getsize(state["path"]) == state["size"]:
+                # Another request finished the upload between our state check and open(): drop the stray .part
+                os.unlink(part_path)
+                return {**self.upload_state(batch_id, upload_id), "just_completed": False}
+            current = fh.seek(0, os.SEEK_END)
+            if offset != current:
+                raise ValueError(current)
+            remaining = state["size"] - current
+            while remaining > 0:
+                data = stream.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                fh.write(data)
+                remaining -= len(data)
+            fh.flush()
+            if remaining == 0:
+                os.replace(part_path, state["path"])
+        self.touch_batch(batch_id)
+        return {**self.upload_state(batch_id, upload_id), "just_completed": remaining == 0}
+
+    # ----- per-file results -----
+
+    def _result_path(self, batch_id: str, filename: str) -> str:
+        return os.path.join(self.upload_root, secure_filename(batch_id), f".{filename}.result.json")
+
+    def record_result(self, batch_id: str, filename: str, **result):
+        """Record the processing status (and output files) of one uploaded file."""
+        _write_json(self._result_path(batch_id, filename), {"filename": filename, **result})
+
+    def batch_results(self, batch_id: str) -> list[dict]:
+        """Status of every file in a batch: uploading, queued, processing, done or failed."""
+        batch_dir = os.path.join(self.upload_root, secure_filename(batch_id))
+        try:
+            names = sorted(os.listdir(batch_dir))
+        except FileNotFoundError:
+            return []
+        results = {}
+        for name in names:
+            if name.endswith(".upload.json"):
+                state = self.upload_state(batch_id, name[1:-len(".upload.json")])
+                if state:
+                    results.setdefault(state["filename"], {
+                        "filename": state["filename"],
+                        "status": "queued" if state["complete"] else "uploading",
+                        "offset": state["offset"], "size": state["size"],
+                    })
+        for name in names:
+            if name.endswith(".result.json"):
+                result = _read_json(os.path.join(batch_dir, name))
+                if result:
+                    results[result["filename"]] = {**results.get(result["filename"], {}), **result}
+        return [results[k] for k in sorted(results)]
+
+    # ----- cleanup -----
+
+    def _batches(self):
+        """Yield (batch_id, last_used, [dirs]) for every batch across both roots."""
+        batches = {}
+        for root in (self.output_root, self.upload_root):
+            try:
+                entries = list(os.scandir(root))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False) or entry.name == BLOB_DIR_NAME:
+                    continue
+                info = batches.setdefault(entry.name, [0.0, []])
+                info[0] = max(info[0], entry.stat().st_mtime)
+                info[1].append(entry.path)
+        for batch_id, (last_used, dirs) in batches.items():
+            yield batch_id, last_used, dirs
+
+    def _usage_bytes(self) -> int:
+        """Bytes used under both roots, counting hardlinked files once."""
+        seen = set()
+        total = 0
+        for root in (self.output_root, self.upload_root):
+            for dirpath, _dirnames, filenames in os.walk(root):
+                for name in filenames:
+                    try:
+                        st = os.lstat(os.path.join(dirpath, name))
+                    except FileNotFoundError:
+                        continue
+                    if (st.st_dev, st.st_ino) in seen:
+                        continue
+                    seen.add((st.st_dev, st.st_ino))
+                    total += st.st_size
+        return total
+
+    def _remove_orphan_blobs(self):
+        try:
+            entries = list(os.scandir(self.blob_root))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                # Only the blob itself links to this inode: no batch uses it any more.
+                if entry.stat(follow_symlinks=False).st_nlink <= 1:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def cleanup(self) -> bool:
+        """
+        Evict expired batches, then least recently used ones until usage is under quota.
+        Returns False without doing anything if another process or thread is already cleaning up.
+        """
+        with open(self.cleanup_lock_path, "a") as lock_fh:
+            try:
+                fcntl.flock(lock_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logging.debug("Storage cleanup already running elsewhere; skipping")
+                return False
+            now = time.time()
+            batches = sorted(self._batches(), key=lambda b: b[1])
+            evictable = [b for b in batches if now - b[1] >= self.min_age_seconds]
+
+            removed = 0
+            for batch_id, last_used, dirs in list(evictable):
+                if now - last_used < self.max_age_seconds:
+                    continue
+                for path in dirs:
+                    shutil.rmtree(path, ignore_errors=True)
+                evictable.remove((batch_id, last_used, dirs))
+                removed += 1
+            self._remove_orphan_blobs()
+
+            usage = self._usage_bytes()
+            while usage > self.quota_bytes and evictable:
+                batch_id, _last_used, dirs = evictable.pop(0)
+                for path in dirs:
+                    shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+                self._remove_orphan_blobs()
+                usage = self._usage_bytes()
+
+            if removed:
+                logging.info(f"Storage cleanup removed {removed} batch(es); {usage / 1_048_576:.1f} MB in use")
+            if usage > self.quota_bytes:
+                logging.warning(f"Storage usage {usage / 1_048_576:.1f} MB exceeds quota; "
+                                f"remaining batches are too recent to evict")
+            return True
+
+    def request_cleanup(self):
+        """Ask the background thread to run cleanup soon; never blocks the caller."""
+        self._wakeup.set()
+
+    def start(self):
+        """Start the background cleanup thread (idempotent)."""
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="storage-cleanup", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.cleanup()
+            except Exception:
+                logging.exception("Storage cleanup failed")
+            self._wakeup.wait(self.cleanup_interval)
+            self._wakeup.clear()
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(data, fh)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> dict | None:
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
@@ -0,0 +1,376 @@
+# watch_inbound.py
+"""
+Long-running ingestion daemon: watches drop folders (INBOUND_ATTACH_DIR by default) and feeds
+new PDFs through split/OCR -> Smartsheet match -> attach as soon as they are fully written.
+
+Linux inotify is used when available (via libc, no extra dependency), otherwise directories
+are polled. A file is only picked up once its size and mtime have been stable for --settle
+seconds, so scanners that write slowly or in several passes are not read half-written.
+Processed files are recorded by content hash in a JSON-lines state file, so restarts and
+re-dropped duplicates do not attach twice.
+
+Examples:
+    python watch_inbound.py                                  # watch INBOUND_ATTACH_DIR
+    python watch_inbound.py /srv/scans /srv/shared/pods --workers 2
+    WATCH_DIRS=/srv/scans:/srv/shared/pods python watch_inbound.py --poll
+"""
+import os
+import sys
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import signal
+import struct
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import app as pod_app
+from batch_process import Checkpoint, match_and_attach, _init_worker, _split_worker
+
+WATCH_DIRS = [d for d in os.getenv("WATCH_DIRS", "").split(os.pathsep) if d] or [pod_app.INBOUND_ATTACH_DIR]
+WATCH_STATE_FILE = os.getenv("WATCH_STATE_FILE", "/tmp/pod_watch_state.jsonl")
+
+# Longest wait between retries of a file that keeps failing (the wait doubles per failure).
+MAX_RETRY_DELAY = 3600.0
+
+# Partial/temporary names written by browsers, scanners and rsync before the final rename.
+_TEMP_SUFFIXES = (".part", ".partial", ".tmp", ".crdownload", "~")
+
+
+def is_candidate(path: str) -> bool:
+    name = os.path.basename(path)
+    if name.startswith(".") or name.lower().endswith(_TEMP_SUFFIXES):
+        return False
+    return name.lower().endswith(".pdf")
+
+
+class PollingWatcher:
+    """Fallback watcher: reports every candidate file in the watched directories on each poll."""
+
+    def __init__(self, directories: list[str], interval: float = 2.0):
+        self.directories = directories
+        self.interval = interval
+
+    def scan(self) -> list[str]:
+        paths = []
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file() and is_candidate(entry.path):
+                            paths.append(entry.path)
+            except FileNotFoundError:
+                logging.warning(f"Watched directory missing: {directory}")
+        return paths
+
+    def poll(self, timeout: float) -> list[str]:
+        time.sleep(min(timeout, self.interval))
+        return self.scan()
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(PollingWatcher):
+    """Event-driven watcher using Linux inotify through libc; raises OSError where unsupported."""
+
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, directories: list[str], interval: float = 2.0):
+        super().__init__(directories, interval)
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wds = {}
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+            if wd < 0:
+                err = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(err, f"inotify_add_watch failed for {directory}")
+            self.wds[wd] = directory
+        self.overflowed = False
+
+    def poll(self, timeout: float) -> list[str]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset + self._EVENT.size <= len(buf):
+            wd, mask, _cookie, length = self._EVENT.unpack_from(buf, offset)
+            offset += self._EVENT.size
+            name = buf[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            if name and wd in self.wds:
+                path = os.path.join(self.wds[wd], os.fsdecode(name))
+                if is_candidate(path):
+                    paths.append(path)
+        if self.overflowed:
+            # Events were dropped by the kernel; fall back to a full listing once.
+            self.overflowed = False
+            paths.extend(self.scan())
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Debouncer:
+    """
+    Tracks candidate files until their size and mtime have stopped changing for `settle` seconds.
+    A file that failed is emitted again, unchanged, only once its retry time has passed.
+    """
+
+    def __init__(self, settle: float):
+        self.settle = settle
+        self.pending = {}  # path -> (size, mtime_ns, stable_since)
+        self.handled = {}  # path -> (size, mtime_ns) when last emitted, so unchanged files are not re-read
+        self.retries = {}  # path -> (failures, retry_at) for files whose last attempt failed
+
+    def touch(self, path: str):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.pending.pop(path, None)
+            self.handled.pop(path, None)
+            self.retries.pop(path, None)
+            return
+        if self.handled.get(path) == (st.st_size, st.st_mtime_ns):
+            retry = self.retries.get(path)
+            if not retry or time.monotonic() < retry[1]:
+                return
+            del self.handled[path]
+        now = time.monotonic()
+        previous = self.pending.get(path)
+        if previous and previous[:2] == (st.st_size, st.st_mtime_ns):
+            return
+        self.pending[path] = (st.st_size, st.st_mtime_ns, now)
+
+    def ready(self) -> list[str]:
+        now = time.monotonic()
+        done = []
+        for path in list(self.pending):
+            # Re-stat so writes that produced no event (e.g. polling mode, NFS) still reset the timer.
+            self.touch(path)
+            entry = self.pending.get(path)
+            if entry and entry[0] > 0 and now - entry[2] >= self.settle:
+                done.append(path)
+                self.handled[path] = entry[:2]
+                del self.pending[path]
+                if path in self.retries:
+                    # Attempt under way: hold further retries until it reports back.
+                    self.retries[path] = (self.retries[path][0], float("inf"))
+        return done
+
+    def retry_later(self, path: str, base_delay: float):
+        """Emit a failed file again, even if unchanged, after base_delay seconds, doubling per failure."""
+        failures = self.retries.get(path, (0, 0.0))[0] + 1
+        delay = min(base_delay * 2 ** (failures - 1), max(base_delay, MAX_RETRY_DELAY))
+        self.retries[path] = (failures, time.monotonic() + delay)
+        return delay
+
+    def succeeded(self, path: str):
+        self.retries.pop(path, None)
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_watcher(directories: list[str], force_poll: bool, interval: float):
+    logger = logging.getLogger("watch_inbound")
+    if not force_poll:
+        try:
+            watcher = InotifyWatcher(directories, interval)
+            logger.info(f"Watching {directories} with inotify")
+            return watcher
+        except OSError as e:
+            logger.warning(f"inotify unavailable ({e}); falling back to polling every {interval}s")
+    logger.info(f"Polling {directories} every {interval}s")
+    return PollingWatcher(directories, interval)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Watch folders and ingest new POD PDFs continuously.")
+    parser.add_argument("directories", nargs="*", default=WATCH_DIRS,
+                        help="Directories to watch (default: WATCH_DIRS or INBOUND_ATTACH_DIR)")
+    parser.add_argument("-w", "--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Split/OCR worker processes (default: half the CPUs)")
+    parser.add_argument("-o", "--output-dir", default=pod_app.OUTPUT_FOLDER,
+                        help=f"Root under which each file's split pages get a batch directory "
+                             f"(default: {pod_app.OUTPUT_FOLDER})")
+    parser.add_argument("--state-file", default=WATCH_STATE_FILE,
+                        help=f"JSON-lines record of processed files (default: {WATCH_STATE_FILE})")
+    parser.add_argument("--settle", type=float, default=3.0,
+                        help="Seconds a file must be unchanged before it is processed (default: 3)")
+    parser.add_argument("--poll", action="store_true", help="Always poll instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Polling interval in seconds (default: 2)")
+    parser.add_argument("--rescan-interval", type=float, default=300.0,
+                        help="Full directory rescan interval, to catch anything inotify missed (default: 300)")
+    parser.add_argument("--cache-ttl", type=float, default=300.0,
+                        help="Seconds to reuse Smartsheet sheet/row/attachment lookups before refetching (default: 300)")
+    parser.add_argument("--flush-interval", type=float, default=30.0,
+                        help="Max seconds row status updates wait before a bulk write while busy (default: 30)")
+    parser.add_argument("--dry-run", action="store_true", help="Split and match but do not attach or record files")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log page text and per-file details")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    logging.getLogger().setLevel(log_level)
+    logger = logging.getLogger("watch_inbound")
+    logger.setLevel(logging.INFO)
+
+    if not pod_app.ss_client:
+        print("SMARTSHEET_API is not set; cannot match against Smartsheet.", file=sys.stderr)
+        return 2
+
+    directories = [os.path.abspath(d) for d in args.directories]
+    gmail_dir = os.path.abspath(pod_app.GMAIL_ATTACH_DIR)
+    if gmail_dir in directories:
+        # The Gmail job already attaches everything it saves there.
+        logger.warning(f"Not watching {gmail_dir}: files there are handled by the Gmail job")
+        directories.remove(gmail_dir)
+    if not directories:
+        print("No directories left to watch.", file=sys.stderr)
+        return 2
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+    pod_app.use_output_folder(args.output_dir)
+
+    state = Checkpoint(None if args.dry_run else args.state_file)
+    watcher = make_watcher(directories, args.poll, args.poll_interval)
+    debouncer = Debouncer(args.settle)
+
+    stopping = False
+
+    def _stop(signum, _frame):
+        nonlocal stopping
+        logger.info(f"Received signal {signum}; finishing in-flight files")
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    max_in_flight = args.workers * 2
+    in_flight = {}  # future -> (path, digest)
+    queued = []     # (path, digest) ready but waiting for a pool slot
+    queued_digests = set()
+    lookup_cache = {}
+    attachment_index = pod_app.AttachmentIndex()
+    row_writer = pod_app.RowStatusWriter()
+    last_flush = time.monotonic()
+    cache_born = time.monotonic()
+
+    for path in watcher.scan():
+        debouncer.touch(path)
+    last_rescan = time.monotonic()
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                 initargs=(args.output_dir, log_level)) as pool:
+            while not stopping or in_flight:
+                if not stopping:
+                    for path in watcher.poll(timeout=0.5 if debouncer.pending or in_flight else args.poll_interval):
+                        debouncer.touch(path)
+                    if time.monotonic() - last_rescan >= args.rescan_interval:
+                        for path in watcher.scan():
+                            debouncer.touch(path)
+                        last_rescan = time.monotonic()
+
+                    for path in debouncer.ready():
+                        try:
+                            digest = file_digest(path)
+                        except OSError as e:
+                            logger.warning(f"Could not read {path}: {e}")
+                            continue
+                        if digest in state or digest in queued_digests:
+                            continue
+                        queued.append((path, digest))
+                        queued_digests.add(digest)
+
+                    while queued and len(in_flight) < max_in_flight:
+                        path, digest = queued.pop(0)
+                        # One output batch per file, so the web app's storage cleanup can evict it
+                        batch_id = pod_app.storage.new_batch_id()
+                        in_flight[pool.submit(_split_worker, path, batch_id)] = (path, digest)
+                else:
+                    time.sleep(0.2)
+
+                for future in [f for f in in_flight if f.done()]:
+                    path, digest = in_flight.pop(future)
+                    queued_digests.discard(digest)
+                    try:
+                        _, saved_files = future.result()
+                    except Exception:
+                        # Not recorded, so it is picked up again once its retry time has passed.
+                        logger.exception(f"Split worker failed for {path}")
+                        delay = debouncer.retry_later(path, args.rescan_interval)
+                        logger.info(f"Retrying {os.path.basename(path)} in {delay:.0f}s")
+                        continue
+
+                    if time.monotonic() - cache_born > args.cache_ttl:
+                        lookup_cache.clear()
+                        attachment_index = pod_app.AttachmentIndex()
+                        cache_born = time.monotonic()
+                    months = pod_app.pick_month_candidates_from_filename(path)
+                    outcomes = match_and_attach(path, saved_files, months, lookup_cache, attachment_index,
+                                                row_writer, args.dry_run)
+                    if any(o["status"] == "failed" for o in outcomes):
+                        # Left unrecorded so it is retried (after a restart, too), with a growing delay
+                        # so a file that keeps failing isn't re-split every poll
+                        delay = debouncer.retry_later(path, args.rescan_interval)
+                        logger.info(f"Retrying {os.path.basename(path)} in {delay:.0f}s")
+                    else:
+                        debouncer.succeeded(path)
+                        state.record(path, outcomes, key=digest)
+                    statuses = ", ".join(o["status"] for o in outcomes)
+                    logger.info(f"{os.path.basename(path)}: {statuses}")
+
+                # Write row status updates in bulk: when the queue drains, or at least every --flush-interval
+                if row_writer.pending and (not in_flight and not queued
+                                           or time.monotonic() - last_flush >= args.flush_interval):
+                    updated, failed = row_writer.flush()
+                    logger.info(f"Row status updates so far: {updated} written, {failed} failed")
+                    last_flush = time.monotonic()
+    finally:
+        # Anything attached since the last bulk write, also when stopping on a signal or an error
+        updated, failed = row_writer.flush()
+        if updated or failed:
+            logger.info(f"Row status updates in total: {updated} written, {failed} failed")
+        if row_writer.pending:
+            logger.warning(f"{row_writer.pending} row status update(s) not written: sheet columns could not be read")
+        watcher.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())